@@ -0,0 +1,307 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+import src.utils.bundle as bundle
+from collections import OrderedDict
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def model_fingerprint(model_path):
+    """
+    Return a content hash of the CRF model file at model_path
+
+    For a model bundle this is the hash recorded in its header, so the same
+    bundle has the same identity wherever it is copied. For a bare crfsuite
+    model the file is hashed, memoized by path, size and modification time
+    so it is only recomputed when the file on disk changes
+    """
+
+    stat = os.stat(model_path)
+    memo_key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+
+    with _fingerprints_lock:
+        if memo_key in _fingerprints:
+            return _fingerprints[memo_key]
+
+    header = bundle.read_header(model_path)
+
+    if header is not None:
+        fingerprint = header["hash"]
+    else:
+        digest = hashlib.sha1()
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        fingerprint = digest.hexdigest()
+
+    with _fingerprints_lock:
+        _fingerprints[memo_key] = fingerprint
+
+    return fingerprint
+
+
+def line_key(line, fingerprint):
+    """
+    Return the cache key for a recipe line tagged by the model with fingerprint
+
+    Lines are only normalized to unicode text; case and whitespace are kept
+    because they change tokenization and the character offsets of the tags
+    """
+
+    text = str(line)
+    return hashlib.sha1((fingerprint + "\0" + text).encode("utf-8")).hexdigest()
+
+
+class TagCache:
+    """
+    Cache of BILUO tags for recipe lines, keyed by line text and model
+
+    Entries are kept in an in-memory LRU tier of at most maxsize lines. If
+    path is given, entries are also written to a SQLite database at that
+    path and read back from it on a memory miss, so they survive restarts.
+    """
+
+    def __init__(self, maxsize=100000, path=None):
+        """
+        Arguments:
+            maxsize: maximum number of lines kept in memory
+            path: optional path to a SQLite database for persistent entries
+        """
+
+        assert (maxsize >= 0)
+
+        self.maxsize = maxsize
+        self.path = path
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS tags "
+                             "(key TEXT PRIMARY KEY, tags TEXT NOT NULL)")
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get(self, key):
+        """
+        Return the cached tags for key, or None if they are not cached
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            tags = None
+            if self._db is not None:
+                row = self._db.execute("SELECT tags FROM tags WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None:
+                    tags = [tuple(t) for t in json.loads(row[0])]
+                    self._remember(key, tags)
+
+            if tags is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return tags
+
+    def put_many(self, items):
+        """
+        Cache tags for many lines at once
+
+        Arguments:
+            items: iterable of (key, tags) pairs
+        """
+
+        items = list(items)
+
+        with self._lock:
+            for key, tags in items:
+                self._remember(key, tags)
+
+            if self._db is not None and items:
+                rows = [(key, json.dumps(tags)) for key, tags in items]
+                self._db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?)",
+                                     rows)
+                self._db.commit()
+
+    def put(self, key, tags):
+        self.put_many([(key, tags)])
+
+    def stats(self):
+        """
+        Return hit and miss counters along with the in-memory size
+        """
+
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._memory)
+        }
+
+    def clear(self):
+        """
+        Drop every entry from both tiers and reset counters
+        """
+
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM tags")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, tags):
+        """
+        Insert into the in-memory tier, evicting least recently used entries
+        """
+
+        if self.maxsize == 0:
+            return
+
+        self._memory[key] = tags
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+
+class PageCache:
+    """
+    Persistent cache of fetched recipe pages keyed by URL, stored in SQLite
+
+    Pages younger than ttl seconds are served without touching the network;
+    older pages are revalidated with their ETag/Last-Modified headers. Once
+    the stored pages exceed max_bytes, the least recently used are evicted.
+    """
+
+    def __init__(self, path="pages.db", ttl=24 * 60 * 60, max_bytes=512 * 2 ** 20):
+        """
+        Arguments:
+            path: path to the SQLite database holding the pages
+            ttl: seconds a page is served without revalidation (None for forever)
+            max_bytes: maximum total size of stored pages
+        """
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS pages "
+                         "(url TEXT PRIMARY KEY, html TEXT NOT NULL, "
+                         "etag TEXT, last_modified TEXT, size INTEGER NOT NULL, "
+                         "fetched REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self._db.commit()
+
+    def get(self, url):
+        """
+        Return the cached entry for url as a dictionary, or None if not cached
+        Entries have keys html, etag, last_modified, fetched and fresh
+        """
+
+        with self._lock:
+            row = self._db.execute("SELECT html, etag, last_modified, fetched "
+                                   "FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            self._db.execute("UPDATE pages SET accessed = ? WHERE url = ?", (now, url))
+            self._db.commit()
+
+        html, etag, last_modified, fetched = row
+        return {
+            "html": html,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": fetched,
+            "fresh": self.ttl is None or now - fetched < self.ttl
+        }
+
+    def put(self, url, html, etag=None, last_modified=None):
+        """
+        Store a freshly fetched page and evict old pages beyond max_bytes
+        """
+
+        now = time.time()
+        size = len(html.encode("utf-8"))
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (url, html, etag, last_modified, size, now, now))
+            self._evict()
+            self._db.commit()
+
+    def revalidated(self, url):
+        """
+        Mark the cached page for url as fresh after a 304 Not Modified response
+        """
+
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched = ?, accessed = ? WHERE url = ?",
+                             (now, now, url))
+            self._db.commit()
+
+    def size(self):
+        """
+        Return the total size in bytes of the stored pages
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM pages")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        """
+        Delete least recently accessed pages until the cache fits in max_bytes
+        """
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT url, size FROM pages ORDER BY accessed").fetchall()
+        evicted = []
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((url,))
+            total -= size
+
+        self._db.executemany("DELETE FROM pages WHERE url = ?", evicted)
@@ -0,0 +1,238 @@
+import sys
+import argparse
+
+# Only the standard library is imported here. Each subcommand imports what it
+# needs when it runs, so that --help and cheap commands start quickly
+
+# SQLite database of stored grocery lists shared by list, remove and show
+STORE = "lists.db"
+
+
+def _tag(args):
+    from app.tagger import TaggerSession, display
+
+    if args.url is not None:
+        from recipe_scrapers import scrape_me as scrape
+        lines = scrape(args.url).ingredients()
+    elif args.lines:
+        lines = args.lines
+    else:
+        lines = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+
+    display(lines, args.data, session=TaggerSession(args.spacy_model))
+
+
+def _filename(filename):
+    return filename[:-4] if filename.endswith(".txt") else filename
+
+
+def _list(args):
+    from app.cache import PageCache
+    from app.fetch import Fetcher
+    from app.grocery_list import GroceryStore, new_list
+
+    cache = PageCache(args.cache, ttl=args.ttl)
+    fetcher = Fetcher(cache=cache, offline=args.offline)
+    store = GroceryStore(args.store) if args.store is not None else None
+
+    try:
+        failures = new_list(_filename(args.filename), args.urls, args.data,
+                            fetcher=fetcher, store=store)
+    finally:
+        fetcher.close()
+        cache.close()
+        if store is not None:
+            store.close()
+
+    return 1 if failures else 0
+
+
+def _remove(args):
+    from app.grocery_list import GroceryStore
+
+    filename = _filename(args.filename)
+    store = GroceryStore(args.store)
+
+    try:
+        missing = [url for url in args.urls if not store.remove_recipe(filename, url)]
+        text = store.render(filename)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+
+    with open(filename + ".txt", "w") as file:
+        file.write(text)
+
+    for url in missing:
+        print(f"{url} is not in {filename}", file=sys.stderr)
+
+    return 1 if missing else 0
+
+
+def _show(args):
+    from app.grocery_list import GroceryStore
+
+    store = GroceryStore(args.store)
+
+    try:
+        if args.filename is None:
+            for name in store.lists():
+                print(name)
+        else:
+            if args.recipes:
+                for url, title in store.recipes(_filename(args.filename)):
+                    print(f"{title}\t{url}")
+            else:
+                print(store.render(_filename(args.filename)))
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+
+
+def _ingest(args):
+    import json
+    from app.ingest import ingest
+
+    out = open(args.output, "w") if args.output is not None else sys.stdout
+    failures = {}
+
+    try:
+        for recipe in ingest(args.paths, args.data, args.spacy_model, args.workers,
+                             args.chunk_size, failures=failures):
+            ingredients = [{"text": i.text, "name": i.name, "quantity": i.quantity, "unit": i.unit}
+                           for i in recipe.ingredients]
+            out.write(json.dumps({"url": recipe.url,
+                                  "title": recipe.title,
+                                  "servings": recipe.servings,
+                                  "instructions": recipe.instructions,
+                                  "ingredients": ingredients}) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    for url, error in failures.items():
+        print(f"Could not extract {url}: {error}", file=sys.stderr)
+
+
+def _train(args):
+    from src.train import train_crf, train_crf_from_shards
+
+    params = {}
+    for param in args.param:
+        name, _, value = param.partition("=")
+        params[name] = value
+
+    if args.shard_dir is not None:
+        train_crf_from_shards(args.shard_dir, args.model, params or None, args.algorithm,
+                              args.spacy_model)
+    else:
+        train_crf(args.features, args.labels, args.model, params or None, args.algorithm,
+                  args.spacy_model)
+
+
+def _build_dataset(args):
+    from src.train import build_dataset
+
+    build_dataset(args.data,
+                  features_path=args.features,
+                  labels_path=args.labels,
+                  n_workers=args.workers,
+                  shard_size=args.shard_size,
+                  batch_size=args.batch_size,
+                  spacy_model=args.spacy_model,
+                  shard_dir=args.shard_dir)
+
+
+def build_parser():
+    """
+    Argument parser for the chef command and its subcommands
+    """
+
+    parser = argparse.ArgumentParser(prog="chef", description="Parse recipes for measurements and ingredients")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    tag = commands.add_parser("tag", help="print tagged ingredient lines")
+    tag.add_argument('lines', nargs='*', type=str, help='ingredient lines (read from stdin if none)')
+    tag.add_argument('--url', type=str, action='store', default=None, help='scrape lines from a recipe URL')
+    tag.add_argument('--data', type=str, action='store', default='data.crfsuite')
+    tag.add_argument('--spacy-model', type=str, action='store', default='en_core_web_sm')
+    tag.set_defaults(run=_tag)
+
+    grocery = commands.add_parser("list", help="write a grocery list for recipe URLs")
+    grocery.add_argument('filename', type=str, action='store')
+    grocery.add_argument('urls', nargs='+', type=str, action='store')
+    grocery.add_argument('--data', type=str, action='store', default='data.crfsuite')
+    grocery.add_argument('--cache', type=str, action='store', default='pages.db')
+    grocery.add_argument('--ttl', type=float, action='store', default=24 * 60 * 60)
+    grocery.add_argument('--offline', action='store_true')
+    grocery.add_argument('--store', type=str, nargs='?', action='store', default=None, const=STORE,
+                         help=f'add the recipes to a list kept in this SQLite database '
+                              f'({STORE} if no path is given)')
+    grocery.set_defaults(run=_list)
+
+    remove = commands.add_parser("remove", help="remove recipes from a stored grocery list")
+    remove.add_argument('filename', type=str, action='store')
+    remove.add_argument('urls', nargs='+', type=str, action='store')
+    remove.add_argument('--store', type=str, action='store', default=STORE,
+                        help='SQLite database the list was stored in by list --store')
+    remove.set_defaults(run=_remove)
+
+    show = commands.add_parser("show", help="print a stored grocery list, or the stored lists")
+    show.add_argument('filename', nargs='?', type=str, action='store', default=None)
+    show.add_argument('--recipes', action='store_true', help='print the recipes in the list instead')
+    show.add_argument('--store', type=str, action='store', default=STORE,
+                      help='SQLite database the list was stored in by list --store')
+    show.set_defaults(run=_show)
+
+    ingest = commands.add_parser("ingest", help="tag saved pages and exports as JSONL recipes")
+    ingest.add_argument('paths', nargs='+', type=str,
+                        help='directories, HTML files, (gzipped) JSONL files or tar archives')
+    ingest.add_argument('--data', type=str, action='store', default='data.crfsuite')
+    ingest.add_argument('--spacy-model', type=str, action='store', default='en_core_web_sm')
+    ingest.add_argument('--workers', type=int, action='store', default=None)
+    ingest.add_argument('--chunk-size', type=int, action='store', default=64)
+    ingest.add_argument('--output', type=str, action='store', default=None)
+    ingest.set_defaults(run=_ingest)
+
+    train = commands.add_parser("train", help="train a CRF model")
+    train.add_argument('model', nargs='?', type=str, action='store', default='data.crfsuite')
+    train.add_argument('--features', type=str, action='store', default='features.pkl')
+    train.add_argument('--labels', type=str, action='store', default='labels.pkl')
+    train.add_argument('--shard-dir', type=str, action='store', default=None,
+                       help='train from the shards of build-dataset --shard-dir instead')
+    train.add_argument('--algorithm', type=str, action='store', default=None)
+    train.add_argument('--param', type=str, action='append', default=[], metavar='NAME=VALUE')
+    train.add_argument('--spacy-model', type=str, action='store', default=None,
+                       help='write a model bundle for the spacy pipeline the features were built with')
+    train.set_defaults(run=_train)
+
+    dataset = commands.add_parser("build-dataset", help="create features and labels from a CSV")
+    dataset.add_argument('data', type=str, action='store')
+    dataset.add_argument('--features', type=str, action='store', default='features.pkl')
+    dataset.add_argument('--labels', type=str, action='store', default='labels.pkl')
+    dataset.add_argument('--workers', type=int, action='store', default=1)
+    dataset.add_argument('--shard-size', type=int, action='store', default=1000)
+    dataset.add_argument('--batch-size', type=int, action='store', default=256)
+    dataset.add_argument('--spacy-model', type=str, action='store', default='en_core_web_sm')
+    dataset.add_argument('--shard-dir', type=str, action='store', default=None)
+    dataset.set_defaults(run=_build_dataset)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of the chef console script
+    """
+
+    args = build_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
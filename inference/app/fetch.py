@@ -0,0 +1,160 @@
+import time
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FetchResult:
+    """
+    Outcome of fetching one recipe URL: the page HTML or the error raised
+    """
+
+    def __init__(self, url, html=None, error=None, elapsed=0.0, cached=False):
+        """
+        Arguments:
+            url: URL that was requested
+            html: text of the page if the fetch succeeded
+            error: exception raised if the fetch failed
+            elapsed: seconds spent on the request, including rate limiting
+            cached: flag indicating whether the page was served from a PageCache
+        """
+
+        self.url = url
+        self.html = html
+        self.error = error
+        self.elapsed = elapsed
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return f"FetchResult({self.url}, {len(self.html)} chars)"
+        return f"FetchResult({self.url}, error={self.error!r})"
+
+
+class Fetcher:
+    """
+    Fetches recipe pages concurrently over pooled HTTP connections
+
+    Connections are kept alive and reused per host. Requests to the same host
+    are spaced at least 1 / rate_limit seconds apart, and each request fails
+    after timeout seconds. With a PageCache, fresh pages are served from disk
+    and stale ones are revalidated; in offline mode only the cache is used.
+    """
+
+    def __init__(self,
+                 max_workers=8,
+                 rate_limit=2.0,
+                 timeout=10.0,
+                 headers=None,
+                 cache=None,
+                 offline=False):
+        """
+        Arguments:
+            max_workers: maximum number of pages fetched at once
+            rate_limit: maximum requests per second to any one host (None for no limit)
+            timeout: seconds to wait for a host to connect or respond
+            headers: optional HTTP headers sent with every request
+            cache: optional PageCache of previously fetched pages
+            offline: flag indicating whether to serve pages only from cache
+        """
+
+        assert (max_workers >= 1)
+        assert (cache is not None or not offline)
+
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+
+        # requests is slow to import and only needed once pages are fetched
+        import requests
+
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update(headers or {"User-Agent": "chef"})
+
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def _wait_for_host(self, host):
+        """
+        Block until a request to host is allowed by the rate limit
+        """
+
+        if not self.rate_limit:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1 / self.rate_limit
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    def fetch(self, url):
+        """
+        Fetch a single URL, returning a FetchResult instead of raising
+        """
+
+        start = time.perf_counter()
+
+        try:
+            entry = self.cache.get(url) if self.cache is not None else None
+
+            if entry is not None and (entry["fresh"] or self.offline):
+                return FetchResult(url, html=entry["html"],
+                                   elapsed=time.perf_counter() - start, cached=True)
+            if self.offline:
+                raise Exception("Page is not cached and fetcher is offline")
+
+            headers = {}
+            if entry is not None and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry is not None and entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+            self._wait_for_host(urlsplit(url).netloc)
+            response = self._session.get(url, headers=headers, timeout=self.timeout)
+
+            if response.status_code == 304 and entry is not None:
+                self.cache.revalidated(url)
+                return FetchResult(url, html=entry["html"],
+                                   elapsed=time.perf_counter() - start, cached=True)
+
+            response.raise_for_status()
+
+            if self.cache is not None:
+                self.cache.put(url, response.text,
+                               response.headers.get("ETag"),
+                               response.headers.get("Last-Modified"))
+
+            return FetchResult(url, html=response.text,
+                               elapsed=time.perf_counter() - start)
+        except Exception as e:
+            return FetchResult(url, error=e, elapsed=time.perf_counter() - start)
+
+    def fetch_all(self, urls):
+        """
+        Fetch many URLs concurrently
+
+        Arguments:
+            urls: iterable of recipe URLs
+
+        Returns:
+            List of FetchResult in the same order as urls
+        """
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.fetch, urls))
+
+    def close(self):
+        self._session.close()
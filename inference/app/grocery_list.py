@@ -1,33 +1,457 @@
+import time
+import sqlite3
 import argparse
-from app.recipe import Recipe
+import threading
+import src.utils.parser as utils
+from app.cache import PageCache
+from app.fetch import Fetcher
+from app.recipe import Ingredient, Recipe
 
 
-def new_list(name, recipe_urls, model_path="data.crfsuite"):
+class GroceryList:
+    """
+    Running totals of ingredients across many recipes
 
-    recipes = []
-    for url in recipe_urls:
-        try:
-            recipe = Recipe(url, model_path)
-            recipes.append(recipe)
-        except:
-            print("Could not parse " + url)
+    Ingredients are indexed by normalized name and by unit type. Quantities
+    of the same type (mass, volume, length) are summed in that type's base
+    unit; other units are summed per unit, and unitless quantities as counts.
+    Totals are converted to display units only when the list is rendered.
+    """
+
+    def __init__(self):
+        # name key -> {unit type or unit: [base total, display unit]}
+        self._totals = {}
+        # name key -> name as first seen
+        self._names = {}
+        # lines that could not be parsed into a named ingredient
+        self._unparsed = []
+
+    def __len__(self):
+        return len(self._names) + len(self._unparsed)
 
-    grocery_list = {}
+    def add_recipe(self, recipe):
+        """
+        Add every ingredient of a Recipe to the totals
+        """
 
-    for recipe in recipes:
         for ingredient in recipe.ingredients:
-            if ingredient.name not in grocery_list:
-                grocery_list[ingredient.name] = ingredient
+            self.add(ingredient)
+
+    def add(self, ingredient):
+        """
+        Add a single Ingredient to the totals
+        """
+
+        if ingredient.name is None:
+            self._unparsed.append(ingredient)
+            return
+
+        key, group, amount = _group(ingredient.name, ingredient.quantity, ingredient.unit)
+        self._names.setdefault(key, ingredient.name)
+        groups = self._totals.setdefault(key, {})
+
+        if amount is None:
+            return
+
+        if group in groups:
+            groups[group][0] += amount
+        else:
+            groups[group] = [amount, ingredient.unit]
+
+    def ingredients(self):
+        """
+        Return the combined list of Ingredients in display units
+
+        Each name yields one Ingredient per unit type it was given in. Mass
+        and volume totals are merged when the ingredient's density is known
+        """
+
+        combined = []
+
+        for key, groups in self._totals.items():
+            combined.extend(_combine(self._names[key], key, groups))
+
+        return combined + self._unparsed
+
+    def __repr__(self):
+        return "\n".join([repr(ingr) for ingr in self.ingredients()])
+
+
+class GroceryStore:
+    """
+    Persistent grocery lists stored in SQLite
+
+    Each list keeps the parsed ingredients of every recipe added to it and
+    running totals by normalized name and group, as in GroceryList. Adding
+    a recipe adds its ingredients to the totals, and removing one recomputes
+    only the totals it contributed to, so lists grow over time without
+    fetching or tagging earlier recipes again. Rendering reads the totals
+    and never loads the models
+    """
+
+    def __init__(self, path="lists.db"):
+        """
+        Arguments:
+            path: path to the SQLite database
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS lists
+                (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS recipes
+                (list INTEGER NOT NULL, url TEXT NOT NULL, title TEXT, added REAL NOT NULL,
+                 PRIMARY KEY (list, url));
+            CREATE TABLE IF NOT EXISTS ingredients
+                (list INTEGER NOT NULL, url TEXT NOT NULL, position INTEGER NOT NULL,
+                 text TEXT, name TEXT, quantity REAL, unit TEXT,
+                 key TEXT, grp TEXT, amount REAL,
+                 PRIMARY KEY (list, url, position));
+            CREATE INDEX IF NOT EXISTS ingredients_by_group ON ingredients (list, key, grp);
+            CREATE TABLE IF NOT EXISTS names
+                (list INTEGER NOT NULL, key TEXT NOT NULL, name TEXT NOT NULL,
+                 count INTEGER NOT NULL, PRIMARY KEY (list, key));
+            CREATE TABLE IF NOT EXISTS totals
+                (list INTEGER NOT NULL, key TEXT NOT NULL, grp TEXT NOT NULL,
+                 total REAL NOT NULL, unit TEXT, PRIMARY KEY (list, key, grp));
+        """)
+        self._db.commit()
+
+    def lists(self):
+        """
+        Names of the stored lists
+        """
+
+        with self._lock:
+            return [name for name, in self._db.execute("SELECT name FROM lists ORDER BY id")]
+
+    def recipes(self, name):
+        """
+        List of (url, title) of the recipes in a list, in the order they were added
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT url, title FROM recipes WHERE list = "
+                                    "(SELECT id FROM lists WHERE name = ?) ORDER BY rowid",
+                                    (name,)).fetchall()
+
+    def add_recipe(self, name, recipe):
+        """
+        Add the ingredients of a tagged Recipe to a list, creating the list if
+        needed. A recipe already in the list is replaced
+        """
+
+        rows = []
+        for position, ingredient in enumerate(recipe.ingredients):
+            if ingredient.name is None:
+                key = group = amount = None
             else:
-                try:
-                    combined = grocery_list[ingredient.name] + ingredient
-                    grocery_list[ingredient.name] = combined
-                except:
-                    grocery_list[str(ingredient.name)+"*"] = ingredient
+                key, group, amount = _group(ingredient.name, ingredient.quantity, ingredient.unit)
+                # Unitless quantities are counted in the group ""
+                if amount is not None and group is None:
+                    group = ""
+            rows.append((position, ingredient.text, ingredient.name, ingredient.quantity,
+                         ingredient.unit, key, group, amount))
+
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO lists (name) VALUES (?)", (name,))
+            list_id, = self._db.execute("SELECT id FROM lists WHERE name = ?", (name,)).fetchone()
+
+            self._remove(list_id, recipe.url)
+
+            self._db.execute("INSERT INTO recipes VALUES (?, ?, ?, ?)",
+                             (list_id, recipe.url, recipe.title, time.time()))
+            self._db.executemany("INSERT INTO ingredients VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(list_id, recipe.url) + row for row in rows])
+
+            for _, _, display, _, unit, key, group, amount in rows:
+                if key is None:
+                    continue
+                self._db.execute("INSERT INTO names VALUES (?, ?, ?, 1) "
+                                 "ON CONFLICT (list, key) DO UPDATE SET count = count + 1",
+                                 (list_id, key, display))
+                if amount is not None:
+                    self._db.execute("INSERT INTO totals VALUES (?, ?, ?, ?, ?) "
+                                     "ON CONFLICT (list, key, grp) "
+                                     "DO UPDATE SET total = total + excluded.total",
+                                     (list_id, key, group, amount, unit))
+
+    def remove_recipe(self, name, url):
+        """
+        Remove a recipe and its ingredients from a list
+
+        Returns:
+            True if the recipe was in the list
+        """
+
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id FROM lists WHERE name = ?", (name,)).fetchone()
+            return row is not None and self._remove(row[0], url)
+
+    def _remove(self, list_id, url):
+        """
+        Remove a recipe inside a transaction. Totals it contributed to are
+        summed again from the remaining ingredients rather than decremented,
+        so repeated additions and removals do not accumulate rounding error,
+        and their names and display units become those first seen among the
+        remaining recipes, as in a GroceryList of them
+        """
+
+        deleted = self._db.execute("DELETE FROM recipes WHERE list = ? AND url = ?",
+                                   (list_id, url)).rowcount
+        if not deleted:
+            return False
+
+        rows = self._db.execute("SELECT key, grp FROM ingredients "
+                                "WHERE list = ? AND url = ? AND key IS NOT NULL",
+                                (list_id, url)).fetchall()
+        self._db.execute("DELETE FROM ingredients WHERE list = ? AND url = ?", (list_id, url))
+
+        for key in dict.fromkeys(key for key, _ in rows):
+            first = self._first("name", list_id, key)
+            if first is None:
+                self._db.execute("DELETE FROM names WHERE list = ? AND key = ?", (list_id, key))
+            else:
+                self._db.execute("UPDATE names SET name = ?, count = (SELECT COUNT(*) FROM ingredients "
+                                 "WHERE list = ? AND key = ?) WHERE list = ? AND key = ?",
+                                 (first, list_id, key, list_id, key))
+
+        for key, group in dict.fromkeys(row for row in rows if row[1] is not None):
+            total, = self._db.execute("SELECT SUM(amount) FROM ingredients "
+                                      "WHERE list = ? AND key = ? AND grp = ?",
+                                      (list_id, key, group)).fetchone()
+            if total is None:
+                self._db.execute("DELETE FROM totals WHERE list = ? AND key = ? AND grp = ?",
+                                 (list_id, key, group))
+            else:
+                self._db.execute("UPDATE totals SET total = ?, unit = ? "
+                                 "WHERE list = ? AND key = ? AND grp = ?",
+                                 (total, self._first("unit", list_id, key, group),
+                                  list_id, key, group))
+
+        return True
+
+    def _first(self, column, list_id, key, group=None):
+        """
+        Value of column for the first remaining ingredient with key, and in
+        group if given, in the order recipes were added (None if there is none)
+        """
+
+        query = ("SELECT i.{} FROM ingredients i JOIN recipes r ON i.list = r.list AND i.url = r.url "
+                 "WHERE i.list = ? AND i.key = ?{} ORDER BY r.rowid, i.position LIMIT 1")
+        if group is None:
+            row = self._db.execute(query.format(column, ""), (list_id, key)).fetchone()
+        else:
+            row = self._db.execute(query.format(column, " AND i.grp = ?"), (list_id, key, group)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def delete_list(self, name):
+        """
+        Remove a list and everything stored for it
+        """
+
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id FROM lists WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return
+            for table in ("totals", "names", "ingredients", "recipes"):
+                self._db.execute(f"DELETE FROM {table} WHERE list = ?", row)
+            self._db.execute("DELETE FROM lists WHERE id = ?", row)
+
+    def ingredients(self, name):
+        """
+        Return the combined list of Ingredients of a list in display units,
+        as GroceryList.ingredients does, followed by unparsed lines
+        """
+
+        with self._lock:
+            row = self._db.execute("SELECT id FROM lists WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(f"No grocery list named {name}")
+
+            names = self._db.execute("SELECT key, name FROM names WHERE list = ? ORDER BY rowid",
+                                     row).fetchall()
+            totals = self._db.execute("SELECT key, grp, total, unit FROM totals "
+                                      "WHERE list = ? ORDER BY rowid", row).fetchall()
+            unparsed = self._db.execute("SELECT text FROM ingredients i JOIN recipes r "
+                                        "ON i.list = r.list AND i.url = r.url "
+                                        "WHERE i.list = ? AND i.key IS NULL "
+                                        "ORDER BY r.rowid, i.position", row).fetchall()
+
+        groups = {key: {} for key, _ in names}
+        for key, group, total, unit in totals:
+            groups[key][group or None] = [total, unit]
+
+        combined = []
+        for key, display in names:
+            combined.extend(_combine(display, key, groups[key]))
+
+        return combined + [Ingredient(None, text=text) for text, in unparsed]
+
+    def render(self, name):
+        """
+        Text of a list, one ingredient per line
+        """
+
+        return "\n".join([repr(ingr) for ingr in self.ingredients(name)])
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _group(name, quantity, unit):
+    """
+    Key, group and amount an ingredient is added to the totals with
+
+    The key is the normalized name. The group is the unit type for mass,
+    volume and length, with the amount in that type's base unit, and
+    otherwise the unit itself (None if unitless). group and amount are None
+    if there is no quantity
+    """
+
+    key = name.strip().lower()
+
+    if quantity is None:
+        return key, None, None
+
+    group = utils.unit_type(unit)
+    if group is not None:
+        return key, group, quantity * utils.UNITS[group][unit]
+    return key, unit, quantity
+
+
+def _combine(name, key, groups):
+    """
+    Ingredients in display units for the totals of one name
+
+    Arguments:
+        name: name to display
+        key: normalized name, used to look up the density
+        groups: dictionary mapping each group to [base total, display unit]
+    """
+
+    groups = dict(groups)
+    combined = []
+
+    if "mass" in groups and "volume" in groups:
+        try:
+            volume, _ = groups["volume"]
+            factor = utils.conversion("ml", "g", key)
+            groups["mass"] = [groups["mass"][0] + volume * factor,
+                              groups["mass"][1]]
+            del groups["volume"]
+        except Exception:
+            pass
+
+    if not groups:
+        combined.append(Ingredient(name))
+
+    for group, (total, unit) in groups.items():
+        if group in utils.UNITS:
+            combined.append(Ingredient(name, total / utils.UNITS[group][unit], unit))
+        else:
+            combined.append(Ingredient(name, total, unit))
+
+    return combined
+
+
+def new_list(name,
+             recipe_urls,
+             model_path="data.crfsuite",
+             session=None,
+             fetcher=None,
+             metrics=None,
+             store=None):
+    """
+    Fetch and tag recipes, then write their combined ingredients to <name>.txt
+
+    With a GroceryStore, the recipes are added to the stored list called name
+    and the file is written from the whole stored list. Recipes already in
+    that list are not fetched or tagged again
+
+    Arguments:
+        name: file name of the grocery list, without extension
+        recipe_urls: list of recipe URLs
+        model_path: trained CRF data
+        session: TaggerSession holding loaded models (shared default if None)
+        fetcher: Fetcher used to download pages concurrently (default if None)
+        metrics: optional Metrics to record per-URL fetch, scrape and tag time,
+                 and merge time, into
+        store: optional GroceryStore holding the list
+
+    Returns:
+        Dictionary mapping each URL that could not be used to its error
+    """
+
+    failures = {}
+
+    if fetcher is None:
+        fetcher = Fetcher()
+
+    if store is not None:
+        stored = {url for url, _ in store.recipes(name)}
+        recipe_urls = [url for url in recipe_urls if url not in stored]
+
+    pages = fetcher.fetch_all(recipe_urls)
+
+    fetched = []
+    for page in pages:
+        if metrics is not None:
+            metrics.observe("fetch", page.elapsed, {"url": page.url})
+            if not page.ok:
+                metrics.incr("pages_failed")
+            else:
+                metrics.incr("pages_cached" if page.cached else "pages_fetched")
+
+        if not page.ok:
+            print(f"Could not fetch {page.url}: {page.error}")
+            failures[page.url] = page.error
+        else:
+            fetched.append(page)
+
+    # Tag the lines of every recipe together in one batch
+    parse_failures = {}
+    recipes = Recipe.from_many([page.url for page in fetched], model_path, session,
+                               htmls=[page.html for page in fetched],
+                               failures=parse_failures)
+
+    for url, e in parse_failures.items():
+        print(f"Could not parse {url}: {e}")
+    failures.update(parse_failures)
+
+    if metrics is not None:
+        for recipe in recipes:
+            for stage, seconds in recipe.timings.items():
+                metrics.observe(stage, seconds, {"url": recipe.url})
+        metrics.incr("recipes", len(recipes))
+        metrics.incr("failures", len(failures))
+
+    start = time.perf_counter()
+
+    if store is not None:
+        for recipe in recipes:
+            store.add_recipe(name, recipe)
+        text = store.render(name)
+    else:
+        grocery_list = GroceryList()
+        for recipe in recipes:
+            grocery_list.add_recipe(recipe)
+        text = repr(grocery_list)
+
+    if metrics is not None:
+        metrics.observe("merge", time.perf_counter() - start)
 
     with open(name+".txt", "w") as file:
-        ingredients = [repr(ingr) for ingr in grocery_list.values()]
-        file.write("\n".join(ingredients))
+        file.write(text)
+
+    return failures
 
 if __name__ == "__main__":
 
@@ -35,6 +459,9 @@ if __name__ == "__main__":
     parser.add_argument('filename', nargs=1, type=str, action='store')
     parser.add_argument('urls', nargs='+', type=str, action='store', default='data.crfsuite')
     parser.add_argument('--data', nargs='?', type=str, action='store', default='data.crfsuite')
+    parser.add_argument('--cache', nargs='?', type=str, action='store', default='pages.db')
+    parser.add_argument('--ttl', nargs='?', type=float, action='store', default=24 * 60 * 60)
+    parser.add_argument('--offline', action='store_true')
 
     args = parser.parse_args()
     if args.filename[0].endswith(".txt"):
@@ -42,4 +469,7 @@ if __name__ == "__main__":
     else:
         filename = args.filename[0]
 
-    new_list(filename, args.urls, args.model)
+    cache = PageCache(args.cache, ttl=args.ttl)
+    fetcher = Fetcher(cache=cache, offline=args.offline)
+
+    new_list(filename, args.urls, args.data, fetcher=fetcher)
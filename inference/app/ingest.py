@@ -0,0 +1,268 @@
+import os
+import re
+import gzip
+import json
+import tarfile
+from itertools import islice
+from urllib.parse import urlsplit
+from app.pool import TaggerPool, worker_tag
+from app.recipe import Recipe
+
+HTML = (".html", ".htm")
+JSONL = (".jsonl", ".jsonl.gz", ".ndjson", ".ndjson.gz")
+TAR = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+_json_ld = re.compile(r'<script[^>]*type\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+                      re.IGNORECASE | re.DOTALL)
+
+
+def read_records(path, failures=None):
+    """
+    Stream saved recipes from a directory, HTML file, (gzip'd) JSONL export
+    or tar archive, reading one page or line at a time
+
+    A JSONL line is either a crawl record with the page under "html" (and
+    optionally "url"), or a schema.org Recipe object in JSON-LD. Directories
+    are walked in sorted order and tar archives are read sequentially.
+    Lines that are not JSON objects are skipped
+
+    Arguments:
+        path: directory, HTML file, (gzip'd) JSONL file or tar archive
+        failures: optional dictionary to record each skipped JSONL line with
+                  its error, keyed by <file>#<line number>
+
+    Yields:
+        (url, html, data) for each recipe, where html is the page text or
+        None, data is the JSON-LD object or None, and url defaults to the
+        location of the record
+    """
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(HTML + JSONL + TAR):
+                    yield from read_records(os.path.join(root, name), failures)
+
+    elif path.lower().endswith(TAR):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield from _read_file(archive.extractfile(member), member.name,
+                                          f"{path}/{member.name}", failures)
+
+    else:
+        with open(path, "rb") as f:
+            yield from _read_file(f, path, "file://" + os.path.abspath(path), failures)
+
+
+def _read_file(f, name, url, failures):
+    """
+    Records of one HTML or JSONL file object (helper for read_records)
+    """
+
+    name = name.lower()
+
+    if name.endswith(HTML):
+        yield url, f.read().decode("utf-8", errors="replace"), None
+
+    elif name.endswith(JSONL):
+        if name.endswith(".gz"):
+            f = gzip.GzipFile(fileobj=f)
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError(f"Expected a JSON object, got {type(record).__name__}")
+            except ValueError as e:
+                if failures is not None:
+                    failures[f"{url}#{n + 1}"] = str(e)
+                continue
+            if "html" in record:
+                yield record.get("url") or f"{url}#{n + 1}", record["html"], None
+            else:
+                yield record.get("url") or record.get("@id") or f"{url}#{n + 1}", None, record
+
+
+def find_recipe(data):
+    """
+    Find the schema.org Recipe in a JSON-LD document, which may be nested
+    in a list or an @graph
+
+    Returns:
+        The Recipe object, or None if there is none
+    """
+
+    if isinstance(data, list):
+        for item in data:
+            recipe = find_recipe(item)
+            if recipe is not None:
+                return recipe
+
+    elif isinstance(data, dict):
+        types = data.get("@type")
+        if types == "Recipe" or (isinstance(types, list) and "Recipe" in types):
+            return data
+        if "@graph" in data:
+            return find_recipe(data["@graph"])
+
+    return None
+
+
+def _text(value):
+    """
+    Text of a JSON-LD value that may be a string, list or object with a name
+    """
+
+    if isinstance(value, list):
+        return _text(value[0]) if value else ""
+    if isinstance(value, dict):
+        return value.get("name") or value.get("text") or ""
+    return str(value) if value is not None else ""
+
+
+def _steps(instructions):
+    """
+    Flatten recipeInstructions (text, HowToStep or HowToSection) into steps
+    """
+
+    if isinstance(instructions, str):
+        return [step for step in instructions.split("\n") if step.strip()]
+
+    steps = []
+    for item in instructions or []:
+        if isinstance(item, str):
+            steps.append(item)
+        elif isinstance(item, dict):
+            if "itemListElement" in item:
+                steps.extend(_steps(item["itemListElement"]))
+            elif item.get("text"):
+                steps.append(item["text"])
+    return steps
+
+
+def _lines(ingredients):
+    """
+    Ingredient lines of recipeIngredient, which may be a list or a single
+    string with one ingredient per line
+    """
+
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split("\n")
+
+    return [str(line).strip() for line in ingredients or [] if str(line).strip()]
+
+
+def extract(url, html=None, data=None):
+    """
+    Extract the fields of a Recipe from a saved page or JSON-LD object without
+    network access. Pages are read from their JSON-LD if they have any, and
+    otherwise scraped with recipe_scrapers
+
+    Returns:
+        Dictionary of title, servings, publisher, instructions and lines
+
+    Raises:
+        Exception: if no recipe can be found
+    """
+
+    if data is None:
+        for match in _json_ld.finditer(html):
+            try:
+                data = find_recipe(json.loads(match.group(1)))
+            except ValueError:
+                continue
+            if data is not None:
+                break
+    else:
+        data = find_recipe(data)
+
+    if data is not None:
+        return {"title": _text(data.get("name")),
+                "servings": _text(data.get("recipeYield")),
+                "publisher": urlsplit(url).netloc or _text(data.get("publisher")),
+                "instructions": [step.strip() for step in _steps(data.get("recipeInstructions"))],
+                "lines": _lines(data.get("recipeIngredient"))}
+
+    if html is None:
+        raise Exception("Record is not a schema.org Recipe")
+
+    from recipe_scrapers import scrape_html
+
+    recipe = scrape_html(html, org_url=url, supported_only=False)
+    return {"title": recipe.title(),
+            "servings": recipe.yields(),
+            "publisher": recipe.host(),
+            "instructions": recipe.instructions().split("\n"),
+            "lines": recipe.ingredients()}
+
+
+def _ingest_chunk(records):
+    """
+    Extract and tag a chunk of records on a worker process, tagging the
+    lines of every recipe in the chunk as one batch
+
+    Returns:
+        List of (url, fields, tags) for extracted recipes and (url, error,
+        None) for records that could not be extracted
+    """
+
+    extracted = []
+    for url, html, data in records:
+        try:
+            extracted.append((url, extract(url, html, data)))
+        except Exception as e:
+            extracted.append((url, str(e)))
+
+    recipes = [(url, fields) for url, fields in extracted if isinstance(fields, dict)]
+    tags = iter(worker_tag([line for _, fields in recipes for line in fields["lines"]]))
+
+    return [(url, fields, [next(tags) for _ in fields["lines"]] if isinstance(fields, dict) else None)
+            for url, fields in extracted]
+
+
+def ingest(paths,
+           model_path,
+           spacy_model='en_core_web_sm',
+           n_workers=None,
+           chunk_size=64,
+           max_pending=None,
+           failures=None):
+    """
+    Stream recipes from saved pages and exports through the tagger in parallel
+
+    Records are read lazily, grouped into chunks of chunk_size recipes and
+    extracted and tagged on a TaggerPool. At most max_pending chunks (two per
+    worker by default) are in flight, so memory stays bounded however many
+    recipes the archives hold
+
+    Arguments:
+        paths: list of directories, HTML files, (gzip'd) JSONL files or tar archives
+        model_path: trained CRF data
+        spacy_model: name or path of the spacy pipeline to load
+        n_workers: number of worker processes (all cores if None)
+        chunk_size: number of recipes extracted and tagged together
+        max_pending: maximum number of chunks in flight
+        failures: optional dictionary to record each record that could not be
+                  read or extracted with its error; such records are skipped
+
+    Yields:
+        Tagged Recipe for each record, in the order records were read
+    """
+
+    records = (record for path in paths for record in read_records(path, failures))
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+
+    with TaggerPool(model_path, spacy_model, n_workers) as pool:
+        for results in pool.map(_ingest_chunk, chunks, max_pending):
+            for url, fields, tags in results:
+                if tags is None:
+                    if failures is not None:
+                        failures[url] = fields
+                    continue
+
+                yield Recipe.from_fields(url, fields["title"], fields["servings"],
+                                         fields["publisher"], fields["instructions"],
+                                         fields["lines"], model_path, tags=tags)
@@ -0,0 +1,139 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Counters and timers recorded by the tagging pipeline and grocery lists
+
+    Instrumented code only records into a Metrics object when one is passed
+    in, so leaving instrumentation off costs a single None check per batch.
+    Values can optionally carry labels (e.g. url) and are exported in the
+    Prometheus text format
+    """
+
+    def __init__(self, callback=None, prefix="chef"):
+        """
+        Arguments:
+            callback: optional function called with (name, value, labels) on
+                      every recorded counter increment or timing
+            prefix: prefix of metric names in Prometheus output
+        """
+
+        self.callback = callback
+        self.prefix = prefix
+
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1, labels=None):
+        """
+        Add value to the counter name
+        """
+
+        key = (name, _labels_key(labels))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+        if self.callback is not None:
+            self.callback(name, value, labels)
+
+    def observe(self, name, seconds, labels=None):
+        """
+        Record a duration in seconds for the timer name
+        """
+
+        key = (name, _labels_key(labels))
+
+        with self._lock:
+            count, total = self._timers.get(key, (0, 0.0))
+            self._timers[key] = (count + 1, total + seconds)
+
+        if self.callback is not None:
+            self.callback(name, seconds, labels)
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        """
+        Context manager recording the time spent in its block for timer name
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def snapshot(self):
+        """
+        Return current values as {"counters": {...}, "timers": {...}}, keyed by
+        name for unlabelled values and by (name, labels) otherwise
+        """
+
+        with self._lock:
+            counters = dict(self._counters)
+            timers = dict(self._timers)
+
+        def key(name, labels):
+            return name if not labels else (name, labels)
+
+        return {
+            "counters": {key(*k): v for k, v in counters.items()},
+            "timers": {key(*k): {"count": c, "seconds": s} for k, (c, s) in timers.items()}
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def to_prometheus(self):
+        """
+        Return all metrics in the Prometheus text exposition format
+        Counters become <prefix>_<name>_total and timers become summaries
+        <prefix>_<name>_seconds with _count and _sum series
+        """
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted(self._timers.items())
+
+        lines = []
+        typed = set()
+
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        for (name, labels), (count, total) in timers:
+            metric = f"{self.prefix}_{name}_seconds"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} summary")
+                typed.add(metric)
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels):
+    """
+    Format a labels key as {name="value",...} with Prometheus escaping
+    """
+
+    if not labels:
+        return ""
+
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
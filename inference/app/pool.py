@@ -0,0 +1,144 @@
+import os
+import sys
+import multiprocessing
+from collections import deque
+from itertools import islice
+from app.tagger import TaggerSession, _join_tags, tag_stream
+
+# Session and model of the pool a worker process belongs to, set when the
+# worker starts (see _init_worker)
+_pool_session = None
+_pool_model_path = None
+
+
+def _init_worker(session, model_path):
+    """
+    Bind a worker to its pool's session and model. Both are passed when the
+    pool is created and inherited through fork, so workers the pool starts
+    later still use them whatever other pools the parent creates
+    """
+
+    global _pool_session, _pool_model_path
+
+    _pool_session = session
+    _pool_model_path = model_path
+
+
+def worker_tag(lines, keep_biluo=False):
+    """
+    Tag lines with the models loaded before the pool was forked; for use by
+    functions run on the workers with TaggerPool.map
+
+    Returns:
+        List of tags for each line (see tagger.tag)
+    """
+
+    return list(tag_stream(lines, _pool_model_path, keep_biluo=keep_biluo,
+                           batch_size=max(len(lines), 1), session=_pool_session))
+
+
+def _tag_batch(lines):
+    """
+    Tag a batch of lines in a worker process
+
+    Returns:
+        List with a tuple of (label, start, end, biluo) tags for each line.
+        Label strings are interned so each distinct label is pickled once
+        per batch on the way back to the parent
+    """
+
+    intern = sys.intern
+    return [tuple((intern(label), start, end, intern(biluo)) for label, start, end, biluo in tags)
+            for tags in worker_tag(lines, keep_biluo=True)]
+
+
+class TaggerPool:
+    """
+    Tags lines on a pool of worker processes to use more than one core
+
+    The spacy pipeline and CRF model are loaded in the parent before the
+    workers are forked, so workers share the loaded models' memory pages
+    copy-on-write instead of each loading their own. Lines are sent to
+    workers in batches and only plain tuples of tags come back
+    """
+
+    def __init__(self, model_path, spacy_model='en_core_web_sm', n_workers=None, batch_size=256):
+        """
+        Arguments:
+            model_path: trained CRF data
+            spacy_model: name or path of the spacy pipeline to load
+            n_workers: number of worker processes (all cores if None)
+            batch_size: number of lines sent to a worker at a time
+        """
+
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.n_workers = n_workers or os.cpu_count() or 1
+
+        # Load everything before forking so workers inherit loaded models
+        session = TaggerSession(spacy_model)
+        list(tag_stream(["1 cup flour"], model_path, session=session))
+
+        self._pool = multiprocessing.get_context("fork").Pool(self.n_workers, initializer=_init_worker,
+                                                              initargs=(session, model_path))
+
+    def map(self, func, items, max_pending=None):
+        """
+        Apply func to each item on the worker processes
+
+        Unlike Pool.imap, items are only read as results are consumed: at most
+        max_pending items (two per worker by default) are queued or being
+        processed at once, so memory stays bounded for any length of stream
+
+        Arguments:
+            func: module-level function of one item, which may call worker_tag
+            items: any iterable of picklable items
+            max_pending: maximum number of items in flight
+
+        Yields:
+            func(item) for each item, in input order
+        """
+
+        if max_pending is None:
+            max_pending = 2 * self.n_workers
+
+        pending = deque()
+        for item in items:
+            pending.append(self._pool.apply_async(func, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def tag_stream(self, lines, keep_biluo=False):
+        """
+        Lazily tag any iterable of lines across the worker processes
+
+        Yields:
+            Tags (label, start index, end index, <BILUO>) for each line, in input order
+        """
+
+        lines = iter(lines)
+        batches = iter(lambda: list(islice(lines, self.batch_size)), [])
+
+        for tagged in self.map(_tag_batch, batches):
+            for tags in tagged:
+                yield list(tags) if keep_biluo else _join_tags(tags)
+
+    def tag(self, lines, keep_biluo=False):
+        """
+        Tag a list of lines across the worker processes (see tagger.tag)
+        """
+
+        return list(self.tag_stream(lines, keep_biluo))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,12 +1,19 @@
-from tagger import tag
-from recipe_scrapers import scrape_me as scrape
+import time
+import src.utils.parser as utils
+from app.tagger import tag, tag_stream
 
 
 class Ingredient:
     """
-    Class storing structured information about an ingredient in a recipe
+    Immutable structured information about an ingredient in a recipe
+
+    Attributes are stored in slots instead of a per-instance dictionary and
+    cannot be changed after construction; arithmetic and conversion return
+    new Ingredients. For large numbers of ingredients see IngredientTable
     """
 
+    __slots__ = ("name", "quantity", "unit", "unit_type", "text", "_quantity", "_unit")
+
     def __init__(self, name, quantity=None, unit=None, text=None):
         """
         Arguments:
@@ -17,33 +24,38 @@ class Ingredient:
         """
 
         assert (name is not None or text is not None)
-
         assert (isinstance(text, (str, type(None))))
-        self.text = text
-
         assert (isinstance(name, (str, type(None))))
-        self.name = name
-
         assert (isinstance(unit, (str, type(None))))
-        self.unit = utils.standardize(unit)
-        self._unit = unit
-        self.unit_type = utils.unit_type(self.unit)
+
+        standard = utils.standardize(unit)
 
         if isinstance(quantity, str):
             assert (utils.isnumeric(quantity))
-            self.quantity = utils.asfloat(quantity)
-            self._quantity = quantity
+            value = utils.asfloat(quantity)
+            display = quantity
         elif isinstance(quantity, (int, float)):
             assert (quantity >= 0)
-            self.quantity = float(quantity)
-            self._quantity = str(quantity)
+            value = float(quantity)
+            display = str(quantity)
         else:
             assert (quantity is None)
-            if self.unit is not None:
-                self.quantity = 1.0
-                self._quantity = "1.0"
+            if standard is not None:
+                value = 1.0
+                display = "1.0"
             else:
-                self.quantity = self._quantity = None
+                value = display = None
+
+        _fill(self, name, value, standard, utils.unit_type(standard), text, display, unit)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Ingredient is immutable, cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Ingredient is immutable, cannot delete {name}")
+
+    def __reduce__(self):
+        return _ingredient, tuple(getattr(self, slot) for slot in Ingredient.__slots__)
 
     def __repr__(self):
         """
@@ -79,10 +91,14 @@ class Ingredient:
 
         return False
 
+    def __hash__(self):
+        return hash((self.name, self.quantity, self.unit))
+
     def __add__(self, a):
         """
         Add to the quantity of the Ingredient by specifying another Ingredient
-        with matching name attribute or a numeric quantity
+        with matching name attribute or a numeric quantity. The sum is given
+        in the larger of the two units
         """
 
         assert (self.name is not None and self.quantity is not None)
@@ -92,25 +108,31 @@ class Ingredient:
             assert (self.name == a.name and a.quantity is not None)
 
             if self.unit is None and a.unit is None:
-                total = self.quantity + a.quantity
+                return self._with(self.quantity + a.quantity)
 
-            else:
-                factor = utils.conversion(self.unit, a.unit, self.name)
+            factor = utils.conversion(self.unit, a.unit, self.name)
 
-                if factor < 1:
-                    total = a.quantity + factor * self.quantity
-                else:
-                    total = self.quantity + a.quantity / factor
-
-            return Ingredient(self.name, total, self.unit)
+            if factor < 1:
+                return a._with(a.quantity + factor * self.quantity)
+            else:
+                return self._with(self.quantity + a.quantity / factor)
 
         else:
             assert (isinstance(a, (int, float)) and a >= 0)
-            return Ingredient(self.name, self.quantity + a, self.unit)
+            return self._with(self.quantity + a)
+
+    def _with(self, quantity):
+        """
+        New Ingredient with this name and unit and another quantity, skipping
+        the validation and unit lookups of the constructor
+        """
+
+        return _ingredient(self.name, quantity, self.unit, self.unit_type,
+                           None, str(quantity), self.unit)
 
-    def convert_to(self, unit, inplace=False):
+    def convert_to(self, unit):
         """
-        Convert the quantity to the desired unit
+        Return a new Ingredient with the quantity converted to the desired unit
         """
 
         try:
@@ -119,59 +141,194 @@ class Ingredient:
             print(f"{unit} incompatible with {self._unit} or unrecognized")
             return None
 
-        if inplace:
-            self.quantity = factor * self.quantity
-            self._quantity = str(self.quantity)
-            self.unit = utils.standardize(unit)
-            self._unit = unit
-            return self
-        else:
-            return Ingredient(self.name, factor * self.quantity, unit)
+        standard = utils.standardize(unit)
+        quantity = factor * self.quantity
+        return _ingredient(self.name, quantity, standard, utils.unit_type(standard),
+                           None, str(quantity), unit)
+
+
+def _fill(ingredient, *values):
+    """
+    Set the slots of an Ingredient in __slots__ order (bypasses immutability)
+    """
+
+    for slot, value in zip(Ingredient.__slots__, values):
+        object.__setattr__(ingredient, slot, value)
+
+
+def _ingredient(*values):
+    """
+    Build an Ingredient directly from its slot values, in __slots__ order
+    """
+
+    ingredient = object.__new__(Ingredient)
+    _fill(ingredient, *values)
+    return ingredient
+
+
+def parse_ingredient(line, tags):
+    """
+    Build an Ingredient from a recipe line and its tags, using the first
+    Ingredient, Quantity and Unit span found. If the quantity cannot be
+    interpreted (e.g. a range like "1-2 cups") the name is kept without a
+    quantity or unit, and lines without a name keep only their text
+
+    Arguments:
+        line: Raw recipe line
+        tags: List of (label, start index, end index) returned by tag
+    """
+
+    ingredient = None
+    quantity = None
+    unit = None
+
+    for entity, start, end in tags:
+        if entity == "Ingredient" and ingredient is None:
+            ingredient = line[start:end]
+        if entity == "Quantity" and quantity is None:
+            quantity = line[start:end]
+        if entity == "Unit" and unit is None:
+            unit = line[start:end]
+
+    try:
+        return Ingredient(ingredient, quantity, unit, line)
+    except (AssertionError, ValueError):
+        return Ingredient(ingredient, text=line)
 
 
 class Recipe:
     """
     Class that scrapes a URL containing a recipe and stores structured info
     Ingredient in recipe are tagged using CRF data and stored as Ingredient
+
+    Scraping happens on construction, but tagging is deferred until
+    ingredients is first accessed, so reading the title or instructions
+    never loads the models. Use from_many to tag many recipes in one batch
     """
 
-    def __init__(self, url, model_path):
+    def __init__(self, url, model_path, session=None, html=None):
         """
         Arguments:
             url: Recipe URL supported by recipe_scrapers package
             model_path: Path to trained CRF data
+            session: TaggerSession holding loaded models (shared default if None)
+            html: Already fetched page for url, to skip fetching it again
         """
 
-        # Try to scrape given URL using recipe_scrapers
-        self.url = url
-        recipe = scrape(url)
+        # Seconds spent scraping and tagging this recipe
+        self.timings = {}
+        start = time.perf_counter()
+
+        # Try to scrape given URL using recipe_scrapers (slow to import)
+        from recipe_scrapers import scrape_me as scrape, scrape_html
+
+        if html is None:
+            recipe = scrape(url)
+        else:
+            recipe = scrape_html(html, org_url=url, supported_only=False)
 
         # Extract essential info from scrape results
-        self.instructions = recipe.instructions().split('\n')
-        self.title = recipe.title()
-        self.servings = recipe.yields()
-        self.publisher = recipe.host()
-
-        # Parse ingredients using data
-        self.ingredients = []
-        ingredient_tags = tag(recipe.ingredients(), model_path)
-
-        for line, tags in zip(recipe.ingredients(), ingredient_tags):
-
-            ingredient = None
-            quantity = None
-            unit = None
-
-            for entity, start, end in tags:
-                if tag == "Ingredient" and ingredient is None:
-                    ingredient = line[start:end]
-                if tag == "Quantity" and quantity is None:
-                    quantity = line[start:end]
-                if tag == "Unit" and unit is None:
-                    unit = line[start:end]
-
-            ingr = Ingredient(ingredient, quantity, unit, line)
-            self.ingredients.append(ingr)
+        self._fill(url, recipe.title(), recipe.yields(), recipe.host(),
+                   recipe.instructions().split('\n'), recipe.ingredients(), model_path, session)
+        self.timings["scrape"] = time.perf_counter() - start
+
+    def _fill(self, url, title, servings, publisher, instructions, lines, model_path, session):
+        self.url = url
+        self.title = title
+        self.servings = servings
+        self.publisher = publisher
+        self.instructions = instructions
+
+        # Raw ingredient lines, tagged on first access to ingredients
+        self.lines = lines
+
+        self._model_path = model_path
+        self._session = session
+        self._ingredients = None
+
+    @classmethod
+    def from_fields(cls, url, title, servings, publisher, instructions, lines,
+                    model_path, session=None, tags=None):
+        """
+        Build a Recipe from already extracted fields, without scraping
+
+        Arguments:
+            url: URL or other identifier of the recipe
+            title, servings, publisher: as returned by recipe_scrapers
+            instructions: list of instruction steps
+            lines: list of raw ingredient lines
+            model_path: Path to trained CRF data
+            session: TaggerSession holding loaded models (shared default if None)
+            tags: optional tags of each line (see tagger.tag) if already tagged
+        """
+
+        recipe = cls.__new__(cls)
+        recipe.timings = {}
+        recipe._fill(url, title, servings, publisher, instructions, lines, model_path, session)
+        if tags is not None:
+            recipe._set_tags(tags)
+        return recipe
+
+    @property
+    def ingredients(self):
+        """
+        List of Ingredients parsed from the recipe lines, tagged on first access
+        """
+
+        if self._ingredients is None:
+            start = time.perf_counter()
+            self._set_tags(tag(self.lines, self._model_path, session=self._session))
+            self.timings["tag"] = time.perf_counter() - start
+
+        return self._ingredients
+
+    def _set_tags(self, ingredient_tags):
+        self._ingredients = [parse_ingredient(line, tags)
+                             for line, tags in zip(self.lines, ingredient_tags)]
+
+    @classmethod
+    def from_many(cls, urls, model_path, session=None, htmls=None, failures=None):
+        """
+        Scrape many recipes and tag all of their ingredient lines in a single
+        batch, instead of one tagging call per recipe
+
+        Arguments:
+            urls: list of recipe URLs
+            model_path: Path to trained CRF data
+            session: TaggerSession holding loaded models (shared default if None)
+            htmls: optional list of already fetched pages, one per URL
+            failures: optional dictionary to record each URL that could not be
+                      scraped with its error; if None, errors are raised
+
+        Returns:
+            List of tagged Recipes, in the order of urls. timings["tag"] of
+            each recipe is its share of the batch by number of lines
+        """
+
+        if htmls is None:
+            htmls = [None] * len(urls)
+
+        recipes = []
+        for url, html in zip(urls, htmls):
+            try:
+                recipes.append(cls(url, model_path, session, html=html))
+            except Exception as e:
+                if failures is None:
+                    raise
+                failures[url] = e
+
+        lines = [line for recipe in recipes for line in recipe.lines]
+
+        start = time.perf_counter()
+        tagged = iter(tag_stream(lines, model_path, batch_size=max(len(lines), 1), session=session))
+        for recipe in recipes:
+            recipe._set_tags([next(tagged) for _ in recipe.lines])
+        elapsed = time.perf_counter() - start
+
+        for recipe in recipes:
+            recipe.timings["tag"] = elapsed * len(recipe.lines) / max(len(lines), 1)
+
+        return recipes
 
     def __repr__(self):
 
@@ -0,0 +1,348 @@
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from recipe_scrapers import scrape_html
+from app.cache import model_fingerprint
+from app.fetch import Fetcher
+from app.metrics import Metrics
+from app.recipe import parse_ingredient
+from app.grocery_list import GroceryList
+from app.tagger import TaggerSession, tag
+
+
+class Overloaded(Exception):
+    """
+    Raised when the micro-batch queue cannot accept more lines
+    """
+
+
+class MicroBatcher:
+    """
+    Coalesces lines submitted by concurrent requests into batches for tag
+
+    A batch is sent to the tagger once it holds max_batch lines or when the
+    oldest line in it has waited max_wait seconds, whichever comes first.
+    At most max_queue lines may be waiting; further submissions are refused
+    with Overloaded so that callers can shed load instead of queueing forever
+    """
+
+    def __init__(self, model_path, session, max_batch=256, max_wait=0.005, max_queue=10000):
+        """
+        Arguments:
+            model_path: trained CRF data
+            session: TaggerSession holding loaded models
+            max_batch: maximum number of lines tagged together
+            max_wait: maximum seconds a line waits for its batch to fill
+            max_queue: maximum number of lines waiting to be tagged
+        """
+
+        self.model_path = model_path
+        self.session = session
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, lines):
+        """
+        Tag lines as part of one or more micro-batches
+
+        Returns:
+            List of tags (label, start index, end index) for each line
+
+        Raises:
+            Overloaded: if the queue has no room for all lines
+        """
+
+        if self._queue.maxsize - self._queue.qsize() < len(lines):
+            raise Overloaded(f"{self._queue.qsize()} lines already queued")
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for line in lines:
+            future = loop.create_future()
+            self._queue.put_nowait((line, future))
+            futures.append(future)
+
+        return list(await asyncio.gather(*futures))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        metrics = self.session.metrics
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            lines = [line for line, _ in batch]
+
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, tag, lines, self.model_path, False, self.session)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            if metrics is not None:
+                metrics.incr("batches")
+                metrics.incr("batched_lines", len(batch))
+
+            for (_, future), tags in zip(batch, results):
+                if not future.done():
+                    future.set_result(tags)
+
+
+class Service:
+    """
+    Long-running HTTP service keeping the spacy pipeline and CRF model loaded
+
+    Endpoints:
+        POST /tag           {"lines": [...]} -> {"tags": [[[label, start, end], ...], ...]}
+        POST /grocery-list  {"urls": [...]} -> {"ingredients": [...], "failures": {url: error}}
+        GET  /health        -> {"status": "ok", "model": <model hash>, "queued": <lines waiting>}
+        GET  /metrics       -> metrics in Prometheus text format
+    """
+
+    def __init__(self,
+                 model_path,
+                 session=None,
+                 fetcher=None,
+                 max_batch=256,
+                 max_wait=0.005,
+                 max_queue=10000):
+        """
+        Arguments:
+            model_path: trained CRF data
+            session: TaggerSession holding loaded models (new one with Metrics if None)
+            fetcher: Fetcher used by /grocery-list (default if None)
+            max_batch: maximum number of lines tagged together
+            max_wait: maximum seconds a line waits for its batch to fill
+            max_queue: maximum number of lines waiting before requests get 503
+        """
+
+        if session is None:
+            session = TaggerSession(metrics=Metrics())
+
+        self.model_path = model_path
+        self.session = session
+        self.fetcher = fetcher if fetcher is not None else Fetcher()
+        self.batcher = MicroBatcher(model_path, session, max_batch, max_wait, max_queue)
+
+        self._server = None
+        self._fetch_executor = ThreadPoolExecutor(max_workers=4)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Load models and start listening; returns the bound (host, port)
+        """
+
+        # Load models before accepting requests
+        await asyncio.get_running_loop().run_in_executor(
+            None, tag, ["1 cup flour"], self.model_path, False, self.session)
+
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+        self._fetch_executor.shutdown(wait=True)
+
+    async def _handle(self, reader, writer):
+        """
+        Serve HTTP/1.1 requests on one connection until it is closed
+        """
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                status, content_type, payload = await self._route(method, path, body)
+
+                keep_alive = (version == "HTTP/1.1" and
+                              headers.get("connection", "").lower() != "close")
+
+                head = [f"HTTP/1.1 {status}",
+                        f"Content-Type: {content_type}",
+                        f"Content-Length: {len(payload)}",
+                        "Connection: " + ("keep-alive" if keep_alive else "close")]
+                if status.startswith("503"):
+                    head.append("Retry-After: 1")
+
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        """
+        Dispatch a request and return (status, content type, body bytes)
+        """
+
+        try:
+            if method == "POST" and path == "/tag":
+                result = await self._tag(json.loads(body))
+            elif method == "POST" and path == "/grocery-list":
+                result = await self._grocery_list(json.loads(body))
+            elif method == "GET" and path == "/health":
+                result = {"status": "ok",
+                          "model": model_fingerprint(self.model_path),
+                          "queued": self.batcher.pending}
+            elif method == "GET" and path == "/metrics" and self.session.metrics is not None:
+                text = self.session.metrics.to_prometheus()
+                return "200 OK", "text/plain; version=0.0.4", text.encode()
+            else:
+                return _json("404 Not Found", {"error": f"No route for {method} {path}"})
+        except Overloaded as e:
+            return _json("503 Service Unavailable", {"error": str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            return _json("400 Bad Request", {"error": str(e)})
+        except Exception as e:
+            return _json("500 Internal Server Error", {"error": str(e)})
+
+        return _json("200 OK", result)
+
+    async def _tag(self, request):
+        lines = request["lines"]
+        if not all(isinstance(line, str) for line in lines):
+            raise TypeError("lines must be a list of strings")
+        return {"tags": await self.batcher.submit(lines)}
+
+    async def _grocery_list(self, request):
+        loop = asyncio.get_running_loop()
+        metrics = self.session.metrics
+
+        pages = await loop.run_in_executor(self._fetch_executor,
+                                           self.fetcher.fetch_all, request["urls"])
+
+        async def ingredients(page):
+            # Parsing the page is slow, so keep it off the event loop
+            start = time.perf_counter()
+            lines = await loop.run_in_executor(self._fetch_executor, _scrape_lines, page)
+            scraped = time.perf_counter()
+            tags = await self.batcher.submit(lines)
+            if metrics is not None:
+                # Unlabelled, since per-URL timers would grow without bound
+                metrics.observe("scrape", scraped - start)
+                metrics.observe("tag", time.perf_counter() - scraped)
+            return [parse_ingredient(line, t) for line, t in zip(lines, tags)]
+
+        failures = {page.url: str(page.error) for page in pages if not page.ok}
+        fetched = [page for page in pages if page.ok]
+        results = await asyncio.gather(*[ingredients(page) for page in fetched],
+                                       return_exceptions=True)
+
+        grocery_list = GroceryList()
+        for page, result in zip(fetched, results):
+            if isinstance(result, Overloaded):
+                raise result
+            if isinstance(result, Exception):
+                failures[page.url] = str(result)
+                continue
+            for ingredient in result:
+                grocery_list.add(ingredient)
+
+        return {"ingredients": [repr(ingr) for ingr in grocery_list.ingredients()],
+                "failures": failures}
+
+
+def _scrape_lines(page):
+    """
+    Ingredient lines of a fetched page
+    """
+
+    return scrape_html(page.html, org_url=page.url, supported_only=False).ingredients()
+
+
+def _json(status, result):
+    return status, "application/json", json.dumps(result).encode()
+
+
+async def serve(model_path, host="127.0.0.1", port=8080, **kwargs):
+    """
+    Run a Service until cancelled
+    """
+
+    service = Service(model_path, **kwargs)
+    host, port = await service.start(host, port)
+    print(f"Serving on http://{host}:{port}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+if __name__ == "__main__":
+    """
+    Start the tagging service with the given data path
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('data', nargs='?', type=str, action='store', default='data.crfsuite')
+    argparser.add_argument('--host', type=str, action='store', default='127.0.0.1')
+    argparser.add_argument('--port', type=int, action='store', default=8080)
+    argparser.add_argument('--max-batch', type=int, action='store', default=256)
+    argparser.add_argument('--max-wait', type=float, action='store', default=0.005)
+    argparser.add_argument('--max-queue', type=int, action='store', default=10000)
+    args = argparser.parse_args()
+
+    try:
+        asyncio.run(serve(args.data, args.host, args.port,
+                          max_batch=args.max_batch,
+                          max_wait=args.max_wait,
+                          max_queue=args.max_queue))
+    except KeyboardInterrupt:
+        pass
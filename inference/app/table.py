@@ -0,0 +1,206 @@
+import numpy as np
+from array import array
+import src.utils.parser as utils
+from app.recipe import Ingredient
+
+# Base unit of each unit type, in which grouped quantities are summed
+BASE_UNITS = {group: next(u for u, factor in units.items() if factor == 1)
+              for group, units in utils.UNITS.items()}
+
+
+class IngredientTable:
+    """
+    Columnar store of many parsed ingredients for corpus analytics
+
+    Instead of one object per ingredient, names and units are stored once in
+    small vocabularies and each row is three entries of parallel arrays: a
+    name code, a quantity (NaN if unknown) and a unit code (-1 if none). A
+    row takes 16 bytes, and sums, grouping and unit conversion run over
+    whole columns at once with numpy
+    """
+
+    def __init__(self, ingredients=()):
+        """
+        Arguments:
+            ingredients: optional iterable of Ingredients to add
+        """
+
+        # Distinct names (as first seen) and units (standardized)
+        self.names = []
+        self.units = []
+        self._name_codes = {}
+        self._unit_codes = {}
+        # Normalized name of each name code, used to look up densities
+        self._keys = []
+
+        # Columns
+        self._name = array("i")
+        self._quantity = array("d")
+        self._unit = array("i")
+
+        self.extend(ingredients)
+
+    def __len__(self):
+        return len(self._name)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        quantity = self._quantity[i]
+        unit = self._unit[i]
+        return Ingredient(self.names[self._name[i]],
+                          None if quantity != quantity else quantity,
+                          None if unit < 0 else self.units[unit])
+
+    def __repr__(self):
+        return f"IngredientTable({len(self)} rows, {len(self.names)} names, {len(self.units)} units)"
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the columns, in bytes
+        """
+
+        return sum(column.itemsize * len(column) for column in (self._name, self._quantity, self._unit))
+
+    def append(self, name, quantity=None, unit=None):
+        """
+        Add one row given its name, numeric quantity and unit
+        """
+
+        key = name.strip().lower()
+        code = self._name_codes.get(key)
+        if code is None:
+            code = self._name_codes[key] = len(self.names)
+            self.names.append(name)
+            self._keys.append(key)
+
+        if unit is None:
+            unit_code = -1
+        else:
+            unit = utils.standardize(unit)
+            unit_code = self._unit_codes.get(unit)
+            if unit_code is None:
+                unit_code = self._unit_codes[unit] = len(self.units)
+                self.units.append(unit)
+
+        self._name.append(code)
+        self._quantity.append(np.nan if quantity is None else quantity)
+        self._unit.append(unit_code)
+
+    def extend(self, ingredients):
+        """
+        Add Ingredients; those without a name (unparsed lines) are skipped
+        """
+
+        for ingredient in ingredients:
+            if ingredient.name is not None:
+                self.append(ingredient.name, ingredient.quantity, ingredient.unit)
+
+    def columns(self):
+        """
+        Columns as numpy arrays sharing the table's memory. Rows cannot be
+        added while these arrays are still referenced
+
+        Returns:
+            name codes (indices into names), quantities (NaN if unknown) and
+            unit codes (indices into units, -1 if none)
+        """
+
+        return (np.frombuffer(self._name, dtype=np.intc),
+                np.frombuffer(self._quantity, dtype=float),
+                np.frombuffer(self._unit, dtype=np.intc))
+
+    @staticmethod
+    def _lookup(values, codes):
+        """
+        Map codes to values, with -1 mapping to the last entry of values
+        """
+
+        return np.asarray(values)[codes]
+
+    def convert(self, unit):
+        """
+        Every quantity converted to unit, using each ingredient's density to
+        convert between mass and volume
+
+        Returns:
+            Array of converted quantities, NaN where the conversion is not possible
+        """
+
+        if not len(self):
+            return np.empty(0)
+
+        names, quantities, units = self.columns()
+
+        v = np.full(len(self), utils.UNIT_CODES[utils.standardize(unit)])
+        # Conversion matrix index of each unit, with -1 (no unit) last
+        u = self._lookup([utils.UNIT_CODES.get(x, -1) for x in self.units] + [-1], units)
+        d = self._lookup([utils.density(key) for key in self._keys], names).astype(float)
+
+        return quantities * utils.conversion_factors(u, v, d)
+
+    def sum(self, unit, name=None):
+        """
+        Total quantity of all rows, or of one ingredient, that can be converted to unit
+        """
+
+        converted = self.convert(unit)
+
+        if name is not None:
+            code = self._name_codes.get(name.strip().lower())
+            if code is None:
+                return 0.0
+            converted = converted[self.columns()[0] == code]
+
+        return float(np.nansum(converted))
+
+    def group_by_name(self):
+        """
+        Combine rows by ingredient name and unit type
+
+        Quantities of the same type (mass, volume, length) are summed in that
+        type's base unit (g, ml, cm); other units are summed per unit and
+        unitless quantities as counts. Rows without a quantity only keep the
+        name present
+
+        Returns:
+            New IngredientTable with one row per name and unit group
+        """
+
+        names, quantities, units = self.columns()
+
+        # Base unit and factor to it for each unit, with no unit last
+        base = []
+        factor = []
+        for unit in self.units:
+            group = utils.unit_type(unit)
+            base.append(BASE_UNITS[group] if group else unit)
+            factor.append(utils.UNITS[group][unit] if group else 1.0)
+
+        grouped = IngredientTable()
+        for unit in dict.fromkeys(base):
+            grouped._unit_codes[unit] = len(grouped.units)
+            grouped.units.append(unit)
+        base_codes = [grouped._unit_codes[unit] for unit in base] + [-1]
+
+        amounts = quantities * self._lookup(factor + [1.0], units)
+        groups = self._lookup(base_codes, units)
+
+        # One key per (name, unit group) pair
+        keys, inverse = np.unique(names.astype(np.int64) * (len(grouped.units) + 1) + groups + 1,
+                                  return_inverse=True)
+        known = ~np.isnan(amounts)
+        totals = np.bincount(inverse[known], weights=amounts[known], minlength=len(keys))
+        counts = np.bincount(inverse[known], minlength=len(keys))
+
+        grouped.names = list(self.names)
+        grouped._keys = list(self._keys)
+        grouped._name_codes = dict(self._name_codes)
+        grouped._name = array("i", (keys // (len(grouped.units) + 1)).tolist())
+        grouped._unit = array("i", (keys % (len(grouped.units) + 1) - 1).tolist())
+        grouped._quantity = array("d", np.where(counts > 0, totals, np.nan).tolist())
+
+        return grouped
@@ -1,12 +1,178 @@
-import spacy
-import src.utils.parser as parser
+import time
+import threading
+import src.utils.bundle as bundle
 import src.utils.preprocessor as preprocessor
 import argparse
-import pycrfsuite as crf
-from recipe_scrapers import scrape_me as scrape
+from collections import OrderedDict
+from app.cache import line_key, model_fingerprint
+from contextlib import contextmanager
+from itertools import islice
 
+# spacy, pycrfsuite and recipe_scrapers are slow to import, so they are only
+# imported once a model is loaded or a page is scraped
 
-def tag(ingredients, model_path, keep_biluo=False):
+
+class TaggerSession:
+    """
+    Long-lived holder of the spacy pipeline and opened CRF taggers so that
+    repeated calls to tag do not reload models from disk
+
+    The spacy pipeline is loaded once on first use. CRF taggers are kept in a
+    small registry keyed by model path, and the least recently used tagger is
+    closed once more than max_models are open. A session can be shared
+    between threads; each CRF tagger is used by one thread at a time.
+    """
+
+    def __init__(self, spacy_model='en_core_web_sm', max_models=4, cache=None, metrics=None):
+        """
+        Arguments:
+            spacy_model: name or path of the spacy pipeline to load
+            max_models: maximum number of CRF taggers kept open at once
+            cache: optional TagCache of previously tagged lines
+            metrics: optional Metrics recording timings and counts of tagging
+        """
+
+        assert (max_models >= 1)
+
+        self.spacy_model = spacy_model
+        self.max_models = max_models
+        self.cache = cache
+        self.metrics = metrics
+
+        self._nlp = None
+        self._taggers = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nlp(self):
+        """
+        The spacy pipeline for this session, loaded on first access
+        """
+
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    import spacy
+                    self._nlp = spacy.load(self.spacy_model)
+
+        return self._nlp
+
+    @contextmanager
+    def model(self, model_path):
+        """
+        Context manager yielding an open CRF tagger for model_path, held
+        exclusively by the caller until the block exits
+
+        model_path may be a bare crfsuite model or a model bundle. A bundle's
+        header is checked against this code and the spacy pipeline when it
+        is opened (see src.utils.bundle). Taggers are kept with the model's
+        fingerprint, so a model replaced on disk is opened again
+        """
+
+        # Bundles are checked against the spacy pipeline, so load it first
+        nlp = self.nlp
+
+        while True:
+            evicted = []
+            fingerprint = model_fingerprint(model_path)
+
+            with self._lock:
+                entry = self._taggers.get(model_path)
+                if entry is not None and entry[3] != fingerprint:
+                    # The model was replaced since it was opened
+                    evicted.append(self._taggers.pop(model_path))
+                    entry = None
+                if entry is not None:
+                    self._taggers.move_to_end(model_path)
+                else:
+                    tagger, data = _open_tagger(model_path, nlp)
+                    entry = self._taggers[model_path] = (tagger, threading.Lock(), data, fingerprint)
+                    while len(self._taggers) > self.max_models:
+                        evicted.append(self._taggers.popitem(last=False)[1])
+
+            # Close evicted taggers once any caller still using them is done
+            for old_tagger, old_lock, _, _ in evicted:
+                with old_lock:
+                    old_tagger.close()
+
+            # Wait for the tagger without holding the session lock, so that
+            # other models stay available while this one is in use
+            tagger, lock, _, _ = entry
+            lock.acquire()
+
+            with self._lock:
+                current = self._taggers.get(model_path)
+            if current is entry:
+                break
+
+            # Evicted or closed while waiting, so it is closed or about to be
+            lock.release()
+
+        try:
+            yield tagger
+        finally:
+            lock.release()
+
+    def close(self):
+        """
+        Close all open CRF taggers and drop the spacy pipeline
+        """
+
+        with self._lock:
+            taggers = list(self._taggers.values())
+            self._taggers.clear()
+            self._nlp = None
+
+        for tagger, lock, _, _ in taggers:
+            with lock:
+                tagger.close()
+
+
+def _open_tagger(model_path, nlp):
+    """
+    Open a CRF tagger for a bare crfsuite model or a model bundle
+
+    Returns:
+        tagger: open crfsuite Tagger
+        data: bytes of a bundle's CRF model, which must be kept alive while
+              the tagger is open (None for bare models)
+    """
+
+    import pycrfsuite as crf
+
+    tagger = crf.Tagger()
+    header = bundle.read_header(model_path)
+
+    if header is None:
+        tagger.open(model_path)
+        return tagger, None
+
+    bundle.check_pipeline(header, bundle.nlp_info(nlp))
+    data = bundle.read_model(model_path, header)
+    tagger.open_inmemory(data)
+    return tagger, data
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide default TaggerSession, creating it if needed
+    """
+
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = TaggerSession()
+
+    return _session
+
+
+def tag(ingredients, model_path, keep_biluo=False, session=None):
     """
     Use specified data to tag components for given list of ingredients
 
@@ -14,38 +180,115 @@ def tag(ingredients, model_path, keep_biluo=False):
         ingredients: list of strings containing lines of recipes
         model_path: trained CRF data
         keep_biluo: flag indicating whether to keep BILUO tags in labels
+        session: TaggerSession holding loaded models (shared default if None)
 
     Returns:
         List of tags (label, start index, end index, <BILUO>) for each line
     """
 
-    nlp = spacy.load('en_core_web_sm')
-    tagger = crf.Tagger()
-    tagger.open(model_path)
+    return list(tag_stream(ingredients, model_path, keep_biluo, session=session))
+
+
+def tag_stream(lines,
+               model_path,
+               keep_biluo=False,
+               batch_size=256,
+               n_process=1,
+               session=None):
+    """
+    Lazily tag components for any iterable of ingredient lines, running spacy
+    in batches with nlp.pipe so memory use does not grow with the input
+
+    Arguments:
+        lines: iterable of strings containing lines of recipes
+        model_path: trained CRF data
+        keep_biluo: flag indicating whether to keep BILUO tags in labels
+        batch_size: number of lines spacy processes per batch
+        n_process: number of processes spacy uses for the pipeline of each batch
+        session: TaggerSession holding loaded models (shared default if None)
+
+    Repeated lines within a batch are tagged once, and lines already in the
+    session's TagCache skip spacy and the CRF entirely
+
+    Yields:
+        Tags (label, start index, end index, <BILUO>) for each line, in input order
+    """
+
+    if session is None:
+        session = get_session()
+
+    cache = session.cache
+    metrics = session.metrics
+
+    # Each batch is planned and sent to spacy on its own, so that batches
+    # served entirely from the cache are yielded without reading further input
+    lines = iter(lines)
 
-    results = []
+    for batch in iter(lambda: list(islice(lines, batch_size)), []):
+        start = time.perf_counter()
 
-    for line in ingredients:
+        # Per batch, so lines are cached under the model that tags them even
+        # if it is replaced on disk during the stream
+        fingerprint = model_fingerprint(model_path) if cache is not None else None
 
-        tokens = nlp(line)
-        features = preprocessor.create_features(tokens)
-        prediction = tagger.tag(features)
+        found = {}
+        missing = []
+        for line in batch:
+            if line in found:
+                continue
+            if cache is not None:
+                found[line] = cache.get(line_key(line, fingerprint))
+            else:
+                found[line] = None
+            if found[line] is None:
+                missing.append(line)
 
-        tags = []
-        for token, pred in zip(tokens, prediction):
-            if pred != 'O':
-                biluo, label = pred.split('-')
-                t = (label, token.idx, token.idx + len(token), biluo)
-                tags.append(t)
+        tokens = []
+        if missing:
+            tokens = list(session.nlp.pipe(missing, batch_size=batch_size, n_process=n_process))
+        tokenized = time.perf_counter()
 
-        if not keep_biluo:
-            tags = _join_tags(tags)
+        # Hold the CRF tagger only while a batch is tagged, not while suspended
+        if tokens:
+            with session.model(model_path) as tagger:
+                tagged = [_tag_line(t, tagger) for t in tokens]
 
-        results.append(tags)
+            found.update(zip(missing, tagged))
+            if cache is not None:
+                cache.put_many((line_key(line, fingerprint), tags)
+                               for line, tags in zip(missing, tagged))
 
-    tagger.close()
+        if metrics is not None:
+            metrics.observe("spacy", tokenized - start)
+            metrics.observe("crf", time.perf_counter() - tokenized)
+            metrics.incr("lines", len(batch))
+            metrics.incr("lines_tagged", len(missing))
+            metrics.incr("tokens", sum(len(t) for t in tokens))
+            if cache is not None:
+                metrics.incr("cache_hits", len(found) - len(missing))
+                metrics.incr("cache_misses", len(missing))
 
-    return results
+        for line in batch:
+            tags = found[line]
+            yield list(tags) if keep_biluo else _join_tags(tags)
+
+
+def _tag_line(tokens, tagger):
+    """
+    Tag a single tokenized line with an open CRF tagger (helper for tag function)
+    Returns tags with BILUO kept
+    """
+
+    prediction = tagger.tag(preprocessor.create_items(tokens))
+
+    tags = []
+    for token, pred in zip(tokens, prediction):
+        if pred != 'O':
+            biluo, label = pred.split('-')
+            t = (label, token.idx, token.idx + len(token), biluo)
+            tags.append(t)
+
+    return tags
 
 
 def _join_tags(tags):
@@ -77,9 +320,9 @@ def _join_tags(tags):
     return joined
 
 
-def display(ingredients, model_path):
+def display(ingredients, model_path, session=None):
 
-    tags = tag(ingredients, model_path)
+    tags = tag(ingredients, model_path, session=session)
 
     for line, labels in zip(ingredients, tags):
         print('-' * 40)
@@ -99,6 +342,8 @@ if __name__ == "__main__":
     argparser.add_argument('data', nargs='?', type=str, action='store', default='data.crfsuite')
     args = argparser.parse_args()
 
+    from recipe_scrapers import scrape_me as scrape
+
     try:
         ingredients = scrape(args.url[0]).ingredients()
     except:
@@ -107,6 +352,6 @@ if __name__ == "__main__":
 
     if ingredients is not None:
         try:
-            display(ingredients, args.model)
+            display(ingredients, args.data)
         except:
             raise print("Specified data does not exist or is corrupt")
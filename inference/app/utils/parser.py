@@ -1,5 +1,7 @@
 import re
+import numpy as np
 from src.utils.constants import *
+from src.utils.density import density
 
 # Regex matching integers
 integer_re = r'[0-9]+'
@@ -34,79 +36,161 @@ numeric_re = "|".join([
 ])
 
 
+# Patterns are compiled once at import
+integer_pattern = re.compile(integer_re + '$')
+decimal_pattern = re.compile(decimal_re + '$')
+vulgar_pattern = re.compile(vulgar_re + '$')
+ascii_pattern = re.compile(ascii_re + '$')
+unicode_pattern = re.compile(unicode_re + '$')
+mixed_ascii_pattern = re.compile(mixed_ascii_re + '$')
+mixed_other_pattern = re.compile(mixed_other_re + '$')
+numeric_pattern = re.compile(numeric_re)
+
+# Single pattern classifying a whole string as one kind of quantity, tried in
+# the same order as asfloat checks the individual forms
+quantity_pattern = re.compile("(?:" + "|".join([
+    fr'(?P<mixed_ascii>{mixed_ascii_re})',
+    fr'(?P<mixed_other>{mixed_other_re})',
+    fr'(?P<integer>{integer_re})',
+    fr'(?P<decimal>{decimal_re})',
+    fr'(?P<ascii>{ascii_re})',
+    fr'(?P<vulgar>{vulgar_re})',
+    fr'(?P<unicode>{unicode_re})'
+]) + ')$')
+
+# Characters any match of numeric_re can start with (besides decimal digits)
+numeric_start = set(vul + sup)
+
+# Value of each vulgar fraction character
+VULGAR_VALUE = {c: int(f.split('/')[0]) / int(f.split('/')[1]) for c, f in VULGAR.items()}
+
+TRANSLATE = str.maketrans({**SUPERSCRIPT, **SUBSCRIPT})
+
+
 def integer(s):
-    return re.match(integer_re + '$', s)
+    return integer_pattern.match(s)
 
 
 def decimal(s):
-    return re.match(decimal_re + '$', s)
+    return decimal_pattern.match(s)
 
 
 def vulgarfraction(s):
-    return re.match(vulgar_re + '$', s)
+    return vulgar_pattern.match(s)
 
 
 def asciifraction(s):
-    return re.match(ascii_re + '$', s)
+    return ascii_pattern.match(s)
 
 
 def unicodefraction(s):
-    return re.match(unicode_re + '$', s)
+    return unicode_pattern.match(s)
 
 
 def mixedfraction(s):
-    a = re.match(mixed_ascii_re + '$', s)
+    a = mixed_ascii_pattern.match(s)
     if a:
         return a
 
-    u = re.match(mixed_other_re + '$', s)
+    u = mixed_other_pattern.match(s)
     if u:
         return u
 
 
-# Sensitive to overflow for high fixed precision
-def asfloat(s, precision=-1):
+def _fraction(s):
     """
-    Convert string or numeric quantity to float (rounds 0.5 up)
+    Evaluate a string known to match an ASCII, vulgar or unicode fraction
+    """
+
+    if s in VULGAR_VALUE:
+        return VULGAR_VALUE[s]
+
+    a, b = re.split('[⁄/]', s.translate(TRANSLATE))
+    return int(a) / int(b)
+
+
+def quantity(s, precision=-1):
+    """
+    Classify and evaluate a numeric quantity string in a single scan
 
     Arguments:
-        s: float-like string or numeric quantity
+        s: string possibly containing a quantity
         precision: number of decimal places to keep (maximum by default)
+
+    Returns:
+        (kind, value) where kind is one of "mixed", "integer", "decimal",
+        "ascii", "vulgar" or "unicode", or None if s is not a quantity.
+        value is equal to asfloat(s, precision)
     """
 
+    m = quantity_pattern.match(s)
+    if m is None:
+        return None
+
+    kind = m.lastgroup
     n = 0
-    mixed = mixedfraction(s)
-    if mixed:
-        n = int(mixed[1])
-        s = mixed[2]
 
-    if integer(s) or decimal(s):
+    if kind == "integer" or kind == "decimal":
         x = float(s)
-    elif asciifraction(s) or vulgarfraction(s):
-        s = VULGAR.get(s, s)
-        a = asciifraction(s)
-        x = int(a[1]) / int(a[2])
-    elif unicodefraction(s):
-        u = unicodefraction(s)
-        u1 = ''.join([SUPERSCRIPT[c] for c in u[1]])
-        u2 = ''.join([SUBSCRIPT[c] for c in u[2]])
-        x = int(u1) / int(u2)
+    elif kind == "mixed_ascii" or kind == "mixed_other":
+        n = int(m[m.re.groupindex[kind] + 1])
+        x = _fraction(m[m.re.groupindex[kind] + 2])
+        kind = "mixed"
     else:
-        raise Exception("Could not interpret string as a non-negative float")
+        x = _fraction(s.rstrip('\n'))
 
     # Always round 0.5 up, as in NYT Cooking dataset
     if precision >= 0:
-        return n + int(10 ** precision * x + 0.5) / 10 ** precision
+        return kind, n + int(10 ** precision * x + 0.5) / 10 ** precision
     else:
-        return n + float(x)
+        return kind, n + float(x)
+
+
+def quantities(strings, precision=-1):
+    """
+    Classify and evaluate many strings at once (see quantity)
+
+    Arguments:
+        strings: iterable of strings
+        precision: number of decimal places to keep (maximum by default)
+
+    Returns:
+        List with a (kind, value) pair or None for each string
+    """
+
+    return [quantity(s, precision) for s in strings]
+
+
+# Sensitive to overflow for high fixed precision
+def asfloat(s, precision=-1):
+    """
+    Convert string or numeric quantity to float (rounds 0.5 up)
+
+    Arguments:
+        s: float-like string or numeric quantity
+        precision: number of decimal places to keep (maximum by default)
+    """
+
+    q = quantity(s, precision)
+    if q is None:
+        raise ValueError("Could not interpret string as a non-negative float")
+
+    return q[1]
 
 
 def isnumeric(s):
-    return bool(re.match(numeric_re, s))
+    """
+    Check whether s starts with a numeric quantity
+    """
+
+    if not s or not (s[0].isdecimal() or s[0] in numeric_start):
+        return False
+
+    return bool(numeric_pattern.match(s))
 
 
 def find_numeric(s):
-    return re.finditer(numeric_re, s)
+    return numeric_pattern.finditer(s)
 
 
 def standardize(s):
@@ -131,6 +215,48 @@ def unit_type(u, standardized=True):
         return None
 
 
+def _factor(u, v, density=None):
+    """
+    Conversion factor between two standardized units, given the density of
+    the ingredient if known (helper for conversion and CONVERSION)
+    """
+
+    ut = unit_type(u)
+    vt = unit_type(v)
+
+    if ut == vt:
+        return UNITS[ut][u] / UNITS[vt][v]
+
+    elif density is not None and {ut, vt} == {"mass", "volume"}:
+
+        if ut == "mass" and vt == "volume":
+            mass = UNITS[ut][u]
+            volume = UNITS[vt][v]
+            return mass / (volume * density)
+        else:
+            mass = UNITS[vt][v]
+            volume = UNITS[ut][u]
+            return (volume * density) / mass
+
+    else:
+        return float("nan")
+
+
+# Index of each standardized unit in the conversion matrices
+UNIT_CODES = {u: i for i, u in enumerate([*MASS, *VOLUME, *LENGTH])}
+
+# CONVERSION[i, j] is the factor from unit i to unit j without a density,
+# or NaN if the units cannot be converted
+CONVERSION = np.array([[_factor(u, v) for v in UNIT_CODES] for u in UNIT_CODES])
+
+# Factor of each unit to its type's base unit, and whether it is a mass or volume
+UNIT_FACTORS = np.array([UNITS[unit_type(u)][u] for u in UNIT_CODES])
+IS_MASS = np.array([unit_type(u) == "mass" for u in UNIT_CODES])
+IS_VOLUME = np.array([unit_type(u) == "volume" for u in UNIT_CODES])
+
+_conversion_rows = CONVERSION.tolist()
+
+
 def conversion(u, v, ingredient=None):
     """
     Return conversion factor for converting one specified unit into the other.
@@ -148,30 +274,96 @@ def conversion(u, v, ingredient=None):
 
     u = standardize(u)
     v = standardize(v)
+    assert (u in UNIT_CODES and v in UNIT_CODES)
 
-    ut = unit_type(u)
-    vt = unit_type(v)
-    assert (ut is not None and vt is not None)
+    f = _conversion_rows[UNIT_CODES[u]][UNIT_CODES[v]]
 
-    if ut == vt:
-        return UNITS[ut][u] / UNITS[vt][v]
+    if f != f and ingredient is not None:
+        f = _factor(u, v, density(ingredient))
 
-    elif ingredient in DENSITY:
+    if f != f:
+        raise Exception(f"Cannot convert {u} to {v} for {ingredient}")
 
-        assert ({ut, vt} == {"mass", "volume"})
-        density = DENSITY[ingredient]
+    return f
 
-        if ut == "mass" and vt == "volume":
-            mass = UNITS[ut][u]
-            volume = UNITS[vt][v]
-            return mass / (volume * density)
-        else:
-            mass = UNITS[vt][v]
-            volume = UNITS[ut][u]
-            return (volume * density) / mass
 
-    else:
-        raise Exception
+def unit_codes(units):
+    """
+    Return an array of conversion matrix indices for units, -1 if unrecognized
+    """
+
+    if isinstance(units, str):
+        units = [units]
+
+    return np.array([UNIT_CODES.get(standardize(u), -1) for u in units], dtype=np.intp)
+
+
+def conversion_factors(u, v, densities):
+    """
+    Vectorized conversion factors between arrays of unit codes
+
+    Arguments:
+        u: array of conversion matrix indices to convert from (-1 if unrecognized)
+        v: array of conversion matrix indices to convert to (-1 if unrecognized)
+        densities: array of ingredient densities in g/ml, NaN if unknown
+
+    Returns:
+        Array of factors, NaN where the conversion is not possible
+    """
+
+    known = (u >= 0) & (v >= 0)
+    u = u[known]
+    v = v[known]
+    d = densities[known]
+
+    f = CONVERSION[u, v]
+
+    # Same formulas as _factor for mass and volume given a density
+    to_volume = IS_MASS[u] & IS_VOLUME[v]
+    to_mass = IS_VOLUME[u] & IS_MASS[v]
+    f = np.where(to_volume, UNIT_FACTORS[u] / (UNIT_FACTORS[v] * d), f)
+    f = np.where(to_mass, (UNIT_FACTORS[u] * d) / UNIT_FACTORS[v], f)
+
+    factors = np.full(len(known), np.nan)
+    factors[known] = f
+    return factors
+
+
+def densities_of(ingredients, n):
+    """
+    Array of n densities (NaN if unknown) for a list of ingredient names or a
+    single name shared by all
+    """
+
+    if ingredients is None or isinstance(ingredients, str):
+        ingredients = [ingredients]
+
+    d = np.array([density(i) if i is not None else None for i in ingredients], dtype=float)
+    return np.broadcast_to(d, (n,))
+
+
+def convert_many(quantities, from_units, to_units, ingredients=None):
+    """
+    Convert an array of quantities between units in one vectorized call
+
+    Arguments:
+        quantities: array-like of numeric quantities
+        from_units: unit of each quantity, or a single unit for all of them
+        to_units: unit to convert each quantity to, or a single unit for all
+        ingredients: optional name of each ingredient, or a single name, used
+                     for density conversion between mass and volume
+
+    Returns:
+        Array of converted quantities, NaN where the conversion is not possible
+    """
+
+    quantities = np.asarray(quantities, dtype=float)
+    n = len(quantities)
+
+    u = np.broadcast_to(unit_codes(from_units), (n,))
+    v = np.broadcast_to(unit_codes(to_units), (n,))
+
+    return quantities * conversion_factors(u, v, densities_of(ingredients, n))
 
 
 def is_symbol(s):
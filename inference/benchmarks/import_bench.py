@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+# Modules that must not be imported until a command actually needs them
+HEAVY = ("spacy", "pycrfsuite", "recipe_scrapers", "requests")
+
+# Python snippets whose cold start is measured, each in a fresh interpreter
+TARGETS = {
+    "python": "pass",
+    "app.cli": "import app.cli",
+    "chef --help": "import app.cli, contextlib, io\n"
+                   "with contextlib.redirect_stdout(io.StringIO()):\n"
+                   "    try:\n"
+                   "        app.cli.main(['--help'])\n"
+                   "    except SystemExit:\n"
+                   "        pass",
+    "app.grocery_list": "import app.grocery_list",
+    "app.tagger": "import app.tagger"
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _environment():
+    """
+    Environment for subprocesses with the inference and training directories importable
+    """
+
+    paths = [ROOT, os.path.join(os.path.dirname(ROOT), "training")]
+    if os.environ.get("PYTHONPATH"):
+        paths.append(os.environ["PYTHONPATH"])
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+
+
+def cold_start(code, repeat=5):
+    """
+    Median milliseconds to start a fresh interpreter and run code
+    """
+
+    env = _environment()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+
+def heavy_imports(code):
+    """
+    Heavy modules imported as a side effect of running code
+    """
+
+    check = code + "\nimport sys\nprint(','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+    out = subprocess.run([sys.executable, "-c", check], env=_environment(),
+                         check=True, capture_output=True, text=True).stdout
+    return [m for m in out.strip().splitlines()[-1].split(",") if m] if out.strip() else []
+
+
+def run(repeat=5):
+    """
+    Run the benchmark and return its results as a dictionary
+    """
+
+    return {
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cold_start_ms": {name: cold_start(code, repeat) for name, code in TARGETS.items()},
+        "heavy_imports": {name: heavy_imports(code) for name, code in TARGETS.items()}
+    }
+
+
+if __name__ == "__main__":
+    """
+    Benchmark interpreter cold start for the CLI and the main modules
+    Run from the inference directory: python -m benchmarks.import_bench
+    Fails if the CLI imports a heavy dependency at start up or, with a
+    baseline, if starting the CLI got more than threshold slower
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--repeat', type=int, action='store', default=5)
+    argparser.add_argument('--output', type=str, action='store', default=None)
+    argparser.add_argument('--baseline', type=str, action='store', default=None)
+    argparser.add_argument('--threshold', type=float, action='store', default=0.25)
+    args = argparser.parse_args()
+
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+
+    for name in ("app.cli", "chef --help"):
+        if results["heavy_imports"][name]:
+            print(f"{name} imports {', '.join(results['heavy_imports'][name])} at start up")
+            failed = True
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        for name in ("app.cli", "chef --help"):
+            maximum = (1 + args.threshold) * baseline["cold_start_ms"][name]
+            if results["cold_start_ms"][name] > maximum:
+                print(f"Cold start regression for {name}: {results['cold_start_ms'][name]:.0f} ms "
+                      f"> {maximum:.0f} ms ({args.threshold:.0%} above baseline)")
+                failed = True
+
+    if failed:
+        sys.exit(1)
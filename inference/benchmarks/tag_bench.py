@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import statistics
+import src.utils.preprocessor as preprocessor
+from app.pool import TaggerPool
+from app.tagger import TaggerSession, tag_stream, _join_tags
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus.txt")
+
+
+def load_corpus(path=CORPUS):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def stage_timings(lines, model_path, session, repeat=1):
+    """
+    Tag each line one at a time, timing every stage of the tagging pipeline
+
+    Returns:
+        latencies: seconds taken by each line
+        stages: total seconds spent in each stage
+    """
+
+    nlp = session.nlp
+    latencies = []
+    stages = {"spacy": 0.0, "create_features": 0.0, "crf_tag": 0.0, "join_tags": 0.0}
+
+    with session.model(model_path) as tagger:
+        for _ in range(repeat):
+            for line in lines:
+                t0 = time.perf_counter()
+                tokens = nlp(line)
+                t1 = time.perf_counter()
+                features = preprocessor.create_items(tokens)
+                t2 = time.perf_counter()
+                prediction = tagger.tag(features)
+                t3 = time.perf_counter()
+                tags = []
+                for token, pred in zip(tokens, prediction):
+                    if pred != 'O':
+                        biluo, label = pred.split('-')
+                        tags.append((label, token.idx, token.idx + len(token), biluo))
+                _join_tags(tags)
+                t4 = time.perf_counter()
+
+                latencies.append(t4 - t0)
+                stages["spacy"] += t1 - t0
+                stages["create_features"] += t2 - t1
+                stages["crf_tag"] += t3 - t2
+                stages["join_tags"] += t4 - t3
+
+    return latencies, stages
+
+
+def throughput(lines, model_path, session, repeat=1, batch_size=256):
+    """
+    Lines per second of the batched tag_stream over the corpus
+    """
+
+    start = time.perf_counter()
+    n = 0
+    for _ in tag_stream(lines * repeat, model_path, batch_size=batch_size, session=session):
+        n += 1
+    return n / (time.perf_counter() - start)
+
+
+def pool_throughput(lines, model_path, spacy_model, n_workers, repeat=1, batch_size=64):
+    """
+    Lines per second of a TaggerPool with n_workers processes over the corpus
+    """
+
+    with TaggerPool(model_path, spacy_model, n_workers, batch_size) as pool:
+        # Give every worker a batch first so that start-up is not timed
+        pool.tag(lines[:batch_size] * n_workers)
+
+        start = time.perf_counter()
+        n = 0
+        for _ in pool.tag_stream(lines * repeat):
+            n += 1
+        return n / (time.perf_counter() - start)
+
+
+def run(model_path, spacy_model='en_core_web_sm', repeat=5, corpus=CORPUS, workers=()):
+    """
+    Run the benchmark and return its results as a dictionary
+    """
+
+    lines = load_corpus(corpus)
+    session = TaggerSession(spacy_model)
+
+    # Load models and warm up before timing anything
+    start = time.perf_counter()
+    list(tag_stream(lines[:10], model_path, session=session))
+    load_time = time.perf_counter() - start
+
+    latencies, stages = stage_timings(lines, model_path, session, repeat)
+    quantiles = statistics.quantiles(latencies, n=100)
+    n = len(latencies)
+
+    results = {
+        "corpus": os.path.basename(corpus),
+        "lines": len(lines),
+        "repeat": repeat,
+        "model": os.path.basename(model_path),
+        "spacy_model": spacy_model,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "load_s": load_time,
+        "lines_per_sec": throughput(lines, model_path, session, repeat),
+        "latency_ms": {
+            "p50": 1000 * quantiles[49],
+            "p95": 1000 * quantiles[94],
+            "p99": 1000 * quantiles[98]
+        },
+        "stage_ms_per_line": {stage: 1000 * total / n for stage, total in stages.items()},
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+    if workers:
+        results["pool_lines_per_sec"] = {
+            str(n_workers): pool_throughput(lines, model_path, spacy_model, n_workers, repeat)
+            for n_workers in workers
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    """
+    Benchmark tagging throughput and latency on the checked-in corpus
+    Run from the inference directory: python -m benchmarks.tag_bench data.crfsuite
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('data', nargs='?', type=str, action='store', default='data.crfsuite')
+    argparser.add_argument('--spacy-model', type=str, action='store', default='en_core_web_sm')
+    argparser.add_argument('--repeat', type=int, action='store', default=5)
+    argparser.add_argument('--output', type=str, action='store', default=None)
+    argparser.add_argument('--baseline', type=str, action='store', default=None)
+    argparser.add_argument('--threshold', type=float, action='store', default=0.1)
+    argparser.add_argument('--workers', type=int, nargs='*', action='store', default=(),
+                           help='also measure a TaggerPool with each number of workers')
+    args = argparser.parse_args()
+
+    results = run(args.data, args.spacy_model, args.repeat, workers=args.workers)
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        minimum = (1 - args.threshold) * baseline["lines_per_sec"]
+        if results["lines_per_sec"] < minimum:
+            print(f"Throughput regression: {results['lines_per_sec']:.0f} lines/s "
+                  f"< {minimum:.0f} lines/s ({args.threshold:.0%} below baseline)")
+            sys.exit(1)
@@ -0,0 +1,40 @@
+import os
+import sys
+import pytest
+
+# Make app and src importable when the package is not installed
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for path in (os.path.join(ROOT, "training"), os.path.join(ROOT, "inference")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from app.cache import TagCache, line_key, model_fingerprint
+from app.metrics import Metrics
+from app.tagger import TaggerSession
+
+
+@pytest.fixture
+def cached_session(tmp_path):
+    """
+    Factory of TaggerSessions whose TagCache already holds the tags of some
+    lines, so they can be tagged without spacy or a trained model. The spacy
+    pipeline does not exist, so tagging any other line fails
+
+    Returns:
+        function taking a dictionary of line -> tags with BILUO and returning
+        (session, model_path)
+    """
+
+    def make(tags):
+        model_path = str(tmp_path / "model.crfsuite")
+        with open(model_path, "wb") as f:
+            f.write(b"not a real model")
+
+        cache = TagCache()
+        fingerprint = model_fingerprint(model_path)
+        cache.put_many((line_key(line, fingerprint), t) for line, t in tags.items())
+
+        return TaggerSession("no_such_pipeline", cache=cache, metrics=Metrics()), model_path
+
+    return make
@@ -0,0 +1,19 @@
+import pytest
+
+from app.cli import STORE, build_parser
+
+
+def test_list_stores_only_when_asked():
+    parser = build_parser()
+
+    assert parser.parse_args(["list", "groceries", "http://recipes.test/a"]).store is None
+    assert parser.parse_args(["list", "groceries", "http://recipes.test/a", "--store"]).store == STORE
+    assert parser.parse_args(["list", "groceries", "http://recipes.test/a",
+                              "--store", "mine.db"]).store == "mine.db"
+
+
+@pytest.mark.parametrize("args", [["remove", "groceries", "http://recipes.test/a"],
+                                  ["show", "groceries"],
+                                  ["show"]])
+def test_stored_lists_are_read_from_the_same_store(args):
+    assert build_parser().parse_args(args).store == STORE
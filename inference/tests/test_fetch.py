@@ -0,0 +1,238 @@
+import os
+import time
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.cache import PageCache
+from app.fetch import Fetcher
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """
+    Serves saved pages from a directory, recording when each request arrived
+    and the status of each response. Pages also get Last-Modified headers.
+    /slow responds after a delay, and /etag/<page> serves page with an ETag
+    and answers a matching If-None-Match with 304
+    """
+
+    ETAG = '"v1"'
+
+    def do_GET(self):
+        self.server.arrivals.append(time.monotonic())
+        if self.path == "/slow":
+            time.sleep(1.0)
+        if self.path.startswith("/etag/"):
+            return self.send_etag(self.path[len("/etag/"):])
+        super().do_GET()
+
+    def send_etag(self, name):
+        if self.headers.get("If-None-Match") == self.ETAG:
+            self.send_response(304)
+            self.send_header("ETag", self.ETAG)
+            self.end_headers()
+            return
+
+        with open(os.path.join(self.directory, name), "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("ETag", self.ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_response(self, code, message=None):
+        self.server.statuses.append(code)
+        super().send_response(code, message)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    for n in range(5):
+        (tmp_path / f"recipe{n}.html").write_text(f"<html><body>Recipe {n}</body></html>")
+    (tmp_path / "slow").write_text("<html></html>")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(tmp_path)))
+    httpd.arrivals = []
+    httpd.statuses = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}/{path}"
+
+
+def test_results_keep_input_order(server):
+    urls = [url(server, f"recipe{n}.html") for n in (3, 0, 4, 1, 2)]
+    fetcher = Fetcher(max_workers=4, rate_limit=None)
+
+    results = fetcher.fetch_all(urls)
+    fetcher.close()
+
+    assert [result.url for result in results] == urls
+    assert [result.html for result in results] == [f"<html><body>Recipe {n}</body></html>"
+                                                   for n in (3, 0, 4, 1, 2)]
+    assert all(result.ok and not result.cached for result in results)
+
+
+def test_errors_are_reported_per_url(server):
+    urls = [url(server, "recipe0.html"), url(server, "missing.html"), url(server, "recipe1.html")]
+    fetcher = Fetcher(rate_limit=None)
+
+    ok, missing, other = fetcher.fetch_all(urls)
+    fetcher.close()
+
+    assert ok.ok and other.ok
+    assert not missing.ok
+    assert missing.html is None
+    assert "404" in str(missing.error)
+
+
+def test_slow_hosts_time_out(server):
+    fetcher = Fetcher(rate_limit=None, timeout=0.2)
+
+    start = time.monotonic()
+    slow, = fetcher.fetch_all([url(server, "slow")])
+    fetcher.close()
+
+    assert not slow.ok
+    assert "timed out" in str(slow.error).lower()
+    assert time.monotonic() - start < 1.0
+
+
+def test_requests_to_a_host_are_spaced(server):
+    fetcher = Fetcher(max_workers=4, rate_limit=5.0)
+
+    results = fetcher.fetch_all([url(server, f"recipe{n}.html") for n in range(5)])
+    fetcher.close()
+
+    assert all(result.ok for result in results)
+    arrivals = sorted(server.arrivals)
+    assert len(arrivals) == 5
+    # Allow for scheduling jitter in when the server sees each request
+    assert all(b - a >= 0.15 for a, b in zip(arrivals, arrivals[1:]))
+    assert arrivals[-1] - arrivals[0] >= 0.75
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.db"), ttl=0)
+    yield cache
+    cache.close()
+
+
+def fetch_twice(server, cache, path, change):
+    """
+    Fetch path into the cache, change the page on disk, then fetch it again
+    """
+
+    fetcher = Fetcher(rate_limit=None, cache=cache)
+    first = fetcher.fetch(url(server, path))
+    change()
+    second = fetcher.fetch(url(server, path))
+    fetcher.close()
+    return first, second
+
+
+@pytest.mark.parametrize("path", ["etag/recipe0.html", "recipe0.html"])
+def test_not_modified_serves_cached_page(server, cache, tmp_path, path):
+    page = tmp_path / "recipe0.html"
+    stat = os.stat(page)
+
+    def change():
+        # New content with the same modification time, so only a full
+        # response would return it
+        page.write_text("<html><body>Changed</body></html>")
+        os.utime(page, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    first, second = fetch_twice(server, cache, path, change)
+
+    assert server.statuses == [200, 304]
+    assert not first.cached and second.cached
+    assert second.html == first.html == "<html><body>Recipe 0</body></html>"
+    assert cache.get(url(server, path))["html"] == first.html
+
+
+def test_modified_page_replaces_cached_page(server, cache, tmp_path):
+    page = tmp_path / "recipe0.html"
+
+    def change():
+        page.write_text("<html><body>Changed</body></html>")
+        os.utime(page, (time.time() + 10, time.time() + 10))
+
+    first, second = fetch_twice(server, cache, "recipe0.html", change)
+
+    assert server.statuses == [200, 200]
+    assert not second.cached
+    assert second.html == "<html><body>Changed</body></html>"
+    assert cache.get(url(server, "recipe0.html"))["html"] == second.html
+
+
+def test_fresh_pages_skip_the_network(server, tmp_path):
+    cache = PageCache(str(tmp_path / "pages.db"), ttl=60)
+
+    first, second = fetch_twice(server, cache, "recipe0.html", lambda: None)
+    cache.close()
+
+    assert len(server.arrivals) == 1
+    assert second.cached and second.html == first.html
+
+
+def test_pages_expire_after_ttl(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.db"), ttl=0.2)
+    cache.put("http://recipes.test/a", "<html></html>", etag='"a"')
+
+    assert cache.get("http://recipes.test/a")["fresh"]
+    time.sleep(0.25)
+    entry = cache.get("http://recipes.test/a")
+    assert not entry["fresh"] and entry["etag"] == '"a"'
+
+    cache.revalidated("http://recipes.test/a")
+    assert cache.get("http://recipes.test/a")["fresh"]
+    cache.close()
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.db"), max_bytes=250)
+
+    for name in "abc":
+        cache.put(f"http://recipes.test/{name}", name * 100)
+        time.sleep(0.01)
+
+    # b and c fit; a was the least recently used
+    assert cache.get("http://recipes.test/a") is None
+    assert cache.size() == 200
+
+    cache.get("http://recipes.test/b")
+    time.sleep(0.01)
+    cache.put("http://recipes.test/d", "d" * 100)
+
+    assert cache.get("http://recipes.test/c") is None
+    assert cache.get("http://recipes.test/b")["html"] == "b" * 100
+    assert cache.get("http://recipes.test/d")["html"] == "d" * 100
+    cache.close()
+
+
+def test_offline_serves_only_cached_pages(server, cache):
+    online = Fetcher(rate_limit=None, cache=cache)
+    online.fetch(url(server, "recipe0.html"))
+    online.close()
+
+    offline = Fetcher(rate_limit=None, cache=cache, offline=True)
+    hit, miss = offline.fetch_all([url(server, "recipe0.html"), url(server, "recipe1.html")])
+    offline.close()
+
+    assert len(server.arrivals) == 1
+    assert hit.cached and hit.html == "<html><body>Recipe 0</body></html>"
+    assert not miss.ok and "not cached" in str(miss.error)
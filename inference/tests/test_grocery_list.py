@@ -0,0 +1,160 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.fetch import FetchResult
+from app.grocery_list import GroceryList, GroceryStore, new_list
+from app.metrics import Metrics
+from app.recipe import Ingredient
+
+
+def recipe(url, *ingredients):
+    return SimpleNamespace(url=url, title=url.title(), ingredients=list(ingredients))
+
+
+BREAD = recipe("bread",
+               Ingredient("flour", 2, "cup"),
+               Ingredient("butter", 50, "g"),
+               Ingredient("eggs", 2),
+               Ingredient("salt"),
+               Ingredient(None, text="a little love"))
+
+CAKE = recipe("cake",
+              Ingredient("Flour", 100, "g"),
+              Ingredient("butter", 2, "tbsp"),
+              Ingredient("eggs", 3),
+              Ingredient("vanilla", 1, "tsp"))
+
+PANCAKES = recipe("pancakes",
+                  Ingredient("flour", 1, "cup"),
+                  Ingredient("milk", 300, "ml"),
+                  Ingredient("eggs", 1))
+
+
+def expected(*recipes):
+    grocery_list = GroceryList()
+    for r in recipes:
+        grocery_list.add_recipe(r)
+    return grocery_list.ingredients()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = GroceryStore(str(tmp_path / "lists.db"))
+    yield store
+    store.close()
+
+
+def assert_same(store, *recipes):
+    """
+    The stored list has the totals a GroceryList of recipes has
+    """
+
+    stored = store.ingredients("week")
+    reference = expected(*recipes)
+
+    assert sorted(map(repr, stored)) == sorted(map(repr, reference))
+    assert sorted((i.name or "", i.quantity or 0, i.unit or "") for i in stored) == \
+        pytest.approx(sorted((i.name or "", i.quantity or 0, i.unit or "") for i in reference))
+
+
+def test_add_remove_and_re_add_match_grocery_list(store):
+    store.add_recipe("week", BREAD)
+    store.add_recipe("week", CAKE)
+    assert_same(store, BREAD, CAKE)
+
+    store.add_recipe("week", PANCAKES)
+    assert_same(store, BREAD, CAKE, PANCAKES)
+
+    assert store.remove_recipe("week", "cake")
+    assert_same(store, BREAD, PANCAKES)
+
+    store.add_recipe("week", CAKE)
+    assert_same(store, BREAD, PANCAKES, CAKE)
+
+    assert store.remove_recipe("week", "bread")
+    assert store.remove_recipe("week", "pancakes")
+    assert_same(store, CAKE)
+    assert not store.remove_recipe("week", "bread")
+
+
+def test_adding_a_recipe_again_replaces_it(store):
+    store.add_recipe("week", BREAD)
+    store.add_recipe("week", BREAD)
+
+    assert_same(store, BREAD)
+    assert store.recipes("week") == [("bread", "Bread")]
+
+
+def test_lists_persist_and_are_separate(tmp_path):
+    path = str(tmp_path / "lists.db")
+
+    store = GroceryStore(path)
+    store.add_recipe("week", BREAD)
+    store.add_recipe("party", CAKE)
+    store.close()
+
+    store = GroceryStore(path)
+    try:
+        assert store.lists() == ["week", "party"]
+        assert_same(store, BREAD)
+        assert store.render("party") == "\n".join(map(repr, expected(CAKE)))
+
+        store.delete_list("week")
+        assert store.lists() == ["party"]
+        with pytest.raises(KeyError):
+            store.ingredients("week")
+    finally:
+        store.close()
+
+
+PAGE = """<html><head><script type="application/ld+json">
+{"@context": "https://schema.org", "@type": "Recipe", "name": "Bread",
+ "recipeYield": "1 loaf", "recipeIngredient": ["1 cup flour"],
+ "recipeInstructions": [{"@type": "HowToStep", "text": "Bake."}]}
+</script></head><body></body></html>"""
+
+
+class StubFetcher:
+    """
+    Fetcher returning canned pages, marked cached if their URL says so
+    """
+
+    def fetch_all(self, urls):
+        return [FetchResult(url, html=PAGE, cached="cached" in url) if "missing" not in url
+                else FetchResult(url, error=Exception("404 Not Found")) for url in urls]
+
+
+def test_new_list_counts_failed_fetches_separately(tmp_path, cached_session):
+    session, model_path = cached_session(
+        {"1 cup flour": [("Quantity", 0, 1, "U"), ("Unit", 2, 5, "U"), ("Ingredient", 6, 11, "U")]})
+    metrics = Metrics()
+    urls = ["http://recipes.test/fresh", "http://recipes.test/missing/1",
+            "http://recipes.test/cached", "http://recipes.test/missing/2"]
+
+    failures = new_list(str(tmp_path / "list"), urls, model_path, session=session,
+                        fetcher=StubFetcher(), metrics=metrics)
+
+    counters = metrics.snapshot()["counters"]
+    assert set(failures) == {"http://recipes.test/missing/1", "http://recipes.test/missing/2"}
+    assert counters["pages_fetched"] == 1
+    assert counters["pages_cached"] == 1
+    assert counters["pages_failed"] == 2
+    assert (tmp_path / "list.txt").read_text() == "2.0 cup flour"
+
+
+def test_mass_and_volume_are_merged_when_density_is_known():
+    grocery_list = GroceryList()
+    for ingredient in [Ingredient("butter", 1, "cup"), Ingredient("butter", 50, "g"),
+                       Ingredient("water chestnuts", 1, "cup"), Ingredient("water chestnuts", 200, "g")]:
+        grocery_list.add(ingredient)
+
+    butter, *chestnuts = grocery_list.ingredients()
+
+    # One cup of butter weighs 227 g
+    assert (butter.name, butter.unit) == ("butter", "g")
+    assert butter.quantity == pytest.approx(Ingredient("butter", 1, "cup").convert_to("g").quantity + 50)
+    assert butter.quantity == pytest.approx(277, abs=1)
+
+    # Without a density the two stay apart
+    assert sorted((i.quantity, i.unit) for i in chestnuts) == [(1.0, "cup"), (200.0, "g")]
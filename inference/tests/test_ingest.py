@@ -0,0 +1,71 @@
+import io
+import gzip
+import json
+import tarfile
+
+import pytest
+
+from app.ingest import extract, read_records
+
+
+RECIPE = {"@context": "https://schema.org", "@type": "Recipe", "name": "Bread",
+          "recipeYield": "1 loaf", "recipeIngredient": ["1 cup flour", " 2 tbsp butter "],
+          "recipeInstructions": [{"@type": "HowToStep", "text": "Mix."}]}
+
+LINES = [json.dumps(RECIPE), "{not json", "", json.dumps({"url": "http://recipes.test/page",
+                                                          "html": "<html></html>"}), "[1, 2]"]
+
+
+def test_malformed_jsonl_lines_are_skipped(tmp_path):
+    path = tmp_path / "crawl.jsonl"
+    path.write_text("\n".join(LINES) + "\n")
+    failures = {}
+
+    records = list(read_records(str(path), failures))
+
+    url = "file://" + str(path)
+    assert [record_url for record_url, _, _ in records] == [f"{url}#1", "http://recipes.test/page"]
+    assert records[0][2] == RECIPE
+    assert records[1][1] == "<html></html>"
+    assert set(failures) == {f"{url}#2", f"{url}#5"}
+
+
+def test_archives_are_read_in_order(tmp_path):
+    path = tmp_path / "crawl.tar.gz"
+    data = gzip.compress("\n".join(LINES).encode())
+
+    with tarfile.open(str(path), "w:gz") as archive:
+        for name, content in [("a/page.html", b"<html>page</html>"), ("b/crawl.jsonl.gz", data)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    failures = {}
+    records = list(read_records(str(path), failures))
+
+    assert [url for url, _, _ in records] == [f"{path}/a/page.html", f"{path}/b/crawl.jsonl.gz#1",
+                                              "http://recipes.test/page"]
+    assert records[0][1] == "<html>page</html>"
+    assert set(failures) == {f"{path}/b/crawl.jsonl.gz#2", f"{path}/b/crawl.jsonl.gz#5"}
+
+
+def test_extract_reads_json_ld():
+    html = f'<script type="application/ld+json">{json.dumps(RECIPE)}</script>'
+
+    fields = extract("http://recipes.test/bread", html)
+
+    assert fields == {"title": "Bread",
+                      "servings": "1 loaf",
+                      "publisher": "recipes.test",
+                      "instructions": ["Mix."],
+                      "lines": ["1 cup flour", "2 tbsp butter"]}
+
+
+@pytest.mark.parametrize("ingredients, lines", [("1 cup flour", ["1 cup flour"]),
+                                                ("1 cup flour\n 2 tbsp butter \n", ["1 cup flour",
+                                                                                    "2 tbsp butter"]),
+                                                (None, [])])
+def test_extract_reads_ingredient_text(ingredients, lines):
+    fields = extract("http://recipes.test/bread", data=dict(RECIPE, recipeIngredient=ingredients))
+
+    assert fields["lines"] == lines
@@ -0,0 +1,50 @@
+import pytest
+
+from app.grocery_list import GroceryList
+from app.recipe import parse_ingredient
+
+
+def spans(line, **labels):
+    """
+    Tags for the first occurrence of each labelled text in line
+    """
+
+    return [(label, line.index(text), line.index(text) + len(text)) for label, text in labels.items()]
+
+
+def test_parses_name_quantity_and_unit():
+    line = "2 1/2 cups all-purpose flour"
+
+    ingredient = parse_ingredient(line, spans(line, Quantity="2 1/2", Unit="cups",
+                                              Ingredient="all-purpose flour"))
+
+    assert (ingredient.name, ingredient.quantity, ingredient.unit) == ("all-purpose flour", 2.5, "cups")
+    assert ingredient.text == line
+
+
+@pytest.mark.parametrize("line, quantity", [("1-2 cups flour", "1-2"),
+                                            ("1 to 2 cups flour", "1 to 2"),
+                                            ("a few cups flour", "a few")])
+def test_uninterpretable_quantity_keeps_name(line, quantity):
+    ingredient = parse_ingredient(line, spans(line, Quantity=quantity, Unit="cups", Ingredient="flour"))
+
+    assert (ingredient.name, ingredient.quantity, ingredient.unit) == ("flour", None, None)
+    assert repr(ingredient) == line
+
+
+def test_ranged_ingredient_stays_on_grocery_list():
+    line = "1-2 cups flour"
+    grocery_list = GroceryList()
+
+    grocery_list.add(parse_ingredient(line, spans(line, Quantity="1-2", Unit="cups", Ingredient="flour")))
+    grocery_list.add(parse_ingredient("1 cup flour", spans("1 cup flour", Quantity="1", Unit="cup",
+                                                           Ingredient="flour")))
+
+    assert [repr(i) for i in grocery_list.ingredients()] == ["1.0 cup flour"]
+
+
+def test_line_without_name_keeps_text():
+    ingredient = parse_ingredient("salt to taste", [])
+
+    assert ingredient.name is None
+    assert repr(ingredient) == "salt to taste"
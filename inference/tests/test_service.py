@@ -0,0 +1,127 @@
+import json
+import asyncio
+
+import pytest
+
+from app.fetch import FetchResult
+from app.service import Service
+
+
+TAGS = {
+    "1 cup flour": [("Quantity", 0, 1, "U"), ("Unit", 2, 5, "U"), ("Ingredient", 6, 11, "U")],
+    "2 tbsp butter": [("Quantity", 0, 1, "U"), ("Unit", 2, 6, "U"), ("Ingredient", 7, 13, "U")],
+}
+
+RECIPE = """<html><head><script type="application/ld+json">
+{"@context": "https://schema.org", "@type": "Recipe", "name": "Bread",
+ "recipeIngredient": ["1 cup flour", "2 tbsp butter"]}
+</script></head><body></body></html>"""
+
+
+class StubFetcher:
+    """
+    Fetcher returning canned pages by URL
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def fetch_all(self, urls):
+        return [FetchResult(url, html=self.pages[url]) if url in self.pages
+                else FetchResult(url, error=Exception("404 Not Found")) for url in urls]
+
+
+async def request(port, method, path, body=None):
+    """
+    Send one HTTP request to the service and return (status, headers, JSON body)
+    """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    payload = json.dumps(body).encode() if body is not None else b""
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+                  f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload)
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, content = response.partition(b"\r\n\r\n")
+    status, *lines = head.decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, _, value in (l.partition(":") for l in lines)}
+
+    return int(status.split()[1]), headers, json.loads(content) if content.startswith(b"{") else content
+
+
+@pytest.fixture
+def run_service(cached_session):
+    """
+    Run a coroutine taking (service, port) against a Service on a free port
+    """
+
+    def run(test, **kwargs):
+        session, model_path = cached_session(TAGS)
+
+        async def main():
+            service = Service(model_path, session=session, **kwargs)
+            _, port = await service.start("127.0.0.1", 0)
+            try:
+                return await test(service, port)
+            finally:
+                await service.stop()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_concurrent_requests_are_batched(run_service):
+
+    async def test(service, port):
+        requests = [request(port, "POST", "/tag", {"lines": ["1 cup flour"]}) for _ in range(8)]
+        responses = await asyncio.gather(*requests)
+
+        assert [status for status, _, _ in responses] == [200] * 8
+        assert all(body["tags"] == [[["Quantity", 0, 1], ["Unit", 2, 5], ["Ingredient", 6, 11]]]
+                   for _, _, body in responses)
+
+        counters = service.session.metrics.snapshot()["counters"]
+        assert counters["batched_lines"] == 8
+        assert counters["batches"] < 8
+
+    run_service(test, max_wait=0.2)
+
+
+def test_full_queue_is_refused_with_retry_after(run_service):
+
+    async def test(service, port):
+        status, headers, body = await request(port, "POST", "/tag", {"lines": ["1 cup flour"] * 3})
+
+        assert status == 503
+        assert headers["retry-after"] == "1"
+        assert "error" in body
+
+        status, _, _ = await request(port, "POST", "/tag", {"lines": ["1 cup flour"] * 2})
+        assert status == 200
+
+    run_service(test, max_queue=2)
+
+
+def test_grocery_list_reports_failures(run_service):
+    fetcher = StubFetcher({"http://recipes.test/bread": RECIPE,
+                           "http://recipes.test/empty": "<html><body>No recipe</body></html>"})
+
+    async def test(service, port):
+        urls = ["http://recipes.test/bread", "http://recipes.test/empty", "http://recipes.test/missing"]
+        status, _, body = await request(port, "POST", "/grocery-list", {"urls": urls})
+
+        assert status == 200
+        assert body["ingredients"] == ["1.0 cup flour", "2.0 tbsp butter"]
+        assert set(body["failures"]) == {"http://recipes.test/empty", "http://recipes.test/missing"}
+        assert "404" in body["failures"]["http://recipes.test/missing"]
+
+        timers = service.session.metrics.snapshot()["timers"]
+        assert timers["scrape"]["count"] == 1
+        assert not any(isinstance(key, tuple) for key in timers)
+
+    run_service(test, fetcher=fetcher)
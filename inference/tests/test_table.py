@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.grocery_list import GroceryList
+from app.recipe import Ingredient
+from app.table import BASE_UNITS, IngredientTable
+
+
+INGREDIENTS = [
+    Ingredient("flour", 2, "cup"),
+    Ingredient("Flour", 100, "g"),
+    Ingredient("butter", 1, "cup"),
+    Ingredient("butter", 50, "g"),
+    Ingredient("water chestnuts", 1, "cup"),
+    Ingredient("water chestnuts", 200, "g"),
+    Ingredient("eggs", 2),
+    Ingredient("eggs", 1),
+    Ingredient("salt"),
+    Ingredient("saffron", 1, "pinch"),
+    Ingredient("ginger", 2, "cm"),
+    Ingredient(None, text="a little love"),
+]
+
+
+@pytest.fixture
+def table():
+    return IngredientTable(INGREDIENTS)
+
+
+def converted(ingredient, unit):
+    """
+    Quantity of an Ingredient in unit, NaN if it cannot be converted
+    """
+
+    if ingredient.quantity is None or ingredient.unit is None:
+        return math.nan
+    result = ingredient.convert_to(unit)
+    return math.nan if result is None else result.quantity
+
+
+def test_empty_table():
+    table = IngredientTable()
+
+    assert len(table) == 0
+    assert table.convert("g").shape == (0,)
+    assert table.sum("g") == 0.0
+    assert table.sum("g", "flour") == 0.0
+    assert len(table.group_by_name()) == 0
+
+
+def test_rows_round_trip(table):
+    named = [i for i in INGREDIENTS if i.name is not None]
+
+    # Names are stored once per normalized name, as first seen
+    assert [(i.name.lower(), i.quantity, i.unit) for i in table] == \
+        [(i.name.lower(), i.quantity, i.unit) for i in named]
+
+
+@pytest.mark.parametrize("unit", ["g", "kg", "ml", "cup", "tbsp", "cm"])
+def test_convert_matches_ingredients(table, unit):
+    expected = [converted(i, unit) for i in INGREDIENTS if i.name is not None]
+
+    np.testing.assert_allclose(table.convert(unit), expected, equal_nan=True)
+
+
+def test_unknown_density_is_nan(table):
+    result = table.convert("g")
+    names = [i.name for i in table]
+
+    chestnuts = [q for name, q in zip(names, result) if name == "water chestnuts"]
+    assert math.isnan(chestnuts[0])
+    assert chestnuts[1] == 200.0
+
+
+@pytest.mark.parametrize("name", ["flour", "FLOUR ", "butter", "water chestnuts", "eggs", "nutmeg"])
+def test_sum_matches_ingredients(table, name):
+    expected = sum(q for q in (converted(i, "g") for i in INGREDIENTS
+                               if i.name is not None and i.name.strip().lower() == name.strip().lower())
+                   if not math.isnan(q))
+
+    assert table.sum("g", name) == pytest.approx(expected)
+
+
+def test_sum_mixes_mass_and_volume(table):
+    butter = (Ingredient("butter", 1, "cup") + Ingredient("butter", 50, "g")).convert_to("g")
+
+    assert table.sum("g", "butter") == pytest.approx(butter.quantity)
+    assert table.sum("g") == pytest.approx(np.nansum([converted(i, "g") for i in INGREDIENTS
+                                                      if i.name is not None]))
+
+
+def test_group_by_name_matches_grocery_list(table):
+    grocery_list = GroceryList()
+    for ingredient in INGREDIENTS:
+        grocery_list.add(ingredient)
+
+    expected = {}
+    for key, groups in grocery_list._totals.items():
+        for group, (total, _) in groups.items():
+            expected[key, BASE_UNITS.get(group, group)] = total
+        if not groups:
+            expected[key, None] = None
+
+    grouped = table.group_by_name()
+    actual = {(i.name.strip().lower(), i.unit): i.quantity for i in grouped}
+
+    assert actual.keys() == expected.keys()
+    for key, total in expected.items():
+        assert actual[key] == pytest.approx(total)
+
+
+class TestIngredientAdd:
+
+    def test_sum_is_in_the_larger_unit(self):
+        for a, b in [(Ingredient("flour", 1, "cup"), Ingredient("flour", 2, "tbsp")),
+                     (Ingredient("flour", 2, "tbsp"), Ingredient("flour", 1, "cup"))]:
+            total = a + b
+            assert total.unit == "cup"
+            assert total.quantity == pytest.approx(1.125)
+
+    def test_mass_units(self):
+        total = Ingredient("sugar", 100, "g") + Ingredient("sugar", 1, "kg")
+
+        assert total.unit == "kg"
+        assert total.quantity == pytest.approx(1.1)
+
+    def test_mass_and_volume_use_density(self):
+        total = Ingredient("butter", 1, "cup") + Ingredient("butter", 50, "g")
+
+        assert total.unit == "cup"
+        assert total.convert_to("g").quantity == pytest.approx(
+            Ingredient("butter", 1, "cup").convert_to("g").quantity + 50)
+
+    def test_unitless_and_numbers(self):
+        assert (Ingredient("eggs", 2) + Ingredient("eggs", 1)).quantity == 3
+        assert (Ingredient("eggs", 2) + 1.5).quantity == 3.5
+
+    def test_operands_are_unchanged(self):
+        a = Ingredient("flour", 1, "cup")
+        b = Ingredient("flour", 2, "tbsp")
+
+        a + b
+
+        assert (a.quantity, a.unit, b.quantity, b.unit) == (1.0, "cup", 2.0, "tbsp")
@@ -0,0 +1,140 @@
+import time
+import threading
+from itertools import islice
+
+import pytest
+
+import app.tagger as tagger_module
+from app.cache import TagCache
+from app.tagger import TaggerSession, tag, tag_stream
+
+
+LINES = ["1 cup flour", "2 tbsp butter", "a pinch of salt"]
+TAGS = [("Quantity", 0, 1, "U"), ("Unit", 2, 5, "U"), ("Ingredient", 6, 11, "U")]
+
+
+@pytest.fixture
+def session(cached_session):
+    return cached_session({line: TAGS for line in LINES})
+
+
+def test_cached_batches_stream_without_reading_ahead(session):
+    session, model_path = session
+    consumed = 0
+
+    def lines(n):
+        nonlocal consumed
+        for i in range(n):
+            consumed += 1
+            yield LINES[i % len(LINES)]
+
+    tagged = tag_stream(lines(200000), model_path, keep_biluo=True, batch_size=16, session=session)
+
+    assert next(tagged) == TAGS
+    assert consumed == 16
+
+    assert len(list(islice(tagged, 31))) == 31
+    assert consumed == 32
+
+
+def test_cached_lines_are_tagged_in_order(session):
+    session, model_path = session
+
+    tagged = list(tag_stream(LINES * 5, model_path, batch_size=4, session=session))
+
+    assert tagged == [[("Quantity", 0, 1), ("Unit", 2, 5), ("Ingredient", 6, 11)]] * 15
+    assert session.cache.stats()["misses"] == 0
+
+
+class FakeTagger:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_session(monkeypatch, tmp_path):
+    monkeypatch.setattr(tagger_module, "_open_tagger", lambda model_path, nlp: (FakeTagger(), None))
+    monkeypatch.chdir(tmp_path)
+    for name in "abc":
+        (tmp_path / name).write_bytes(name.encode())
+
+    session = TaggerSession(max_models=2)
+    # Skip loading spacy, the fake taggers do not check the pipeline
+    session._nlp = object()
+    return session
+
+
+def test_waiting_for_a_model_does_not_block_others(fake_session):
+    waiting = threading.Event()
+
+    def use(model_path):
+        with fake_session.model(model_path):
+            pass
+
+    def wait_for_a():
+        waiting.set()
+        use("a")
+
+    with fake_session.model("a"):
+        waiter = threading.Thread(target=wait_for_a)
+        waiter.start()
+        waiting.wait()
+        time.sleep(0.05)
+
+        other = threading.Thread(target=use, args=("b",))
+        other.start()
+        other.join(timeout=1)
+        assert not other.is_alive()
+
+    waiter.join(timeout=1)
+    assert not waiter.is_alive()
+
+
+def test_evicted_taggers_are_not_used(fake_session):
+    with fake_session.model("a") as first:
+        pass
+
+    with fake_session.model("b"), fake_session.model("c"):
+        pass
+
+    assert first.closed
+    with fake_session.model("a") as second:
+        assert second is not first and not second.closed
+
+
+def train(model_path, labels):
+    """
+    Train a tiny CRF on "1 cup flour" with the given labels, on the features
+    of a blank spacy pipeline
+    """
+
+    import spacy
+    import pycrfsuite as crf
+    import src.utils.preprocessor as preprocessor
+
+    trainer = crf.Trainer(verbose=False)
+    trainer.append(preprocessor.create_attributes(spacy.blank("en")("1 cup flour")), labels)
+    trainer.set_params({"max_iterations": 50})
+    trainer.train(model_path)
+
+
+def test_model_retrained_in_place_is_reopened(tmp_path):
+    model_path = str(tmp_path / "model.crfsuite")
+    session = TaggerSession("blank:en", cache=TagCache())
+
+    train(model_path, ["U-Quantity", "U-Unit", "U-Ingredient"])
+    first = tag(["1 cup flour"], model_path, session=session)
+
+    train(model_path, ["U-Quantity", "U-Ingredient", "U-Unit"])
+    second = tag(["1 cup flour"], model_path, session=session)
+
+    assert first == [[("Quantity", 0, 1), ("Unit", 2, 5), ("Ingredient", 6, 11)]]
+    assert second == [[("Quantity", 0, 1), ("Ingredient", 2, 5), ("Unit", 6, 11)]]
+    assert session.cache.stats()["misses"] == 2
+
+    # Lines cached for the retrained model keep its tags
+    assert tag(["1 cup flour"], model_path, session=session) == second
@@ -2,7 +2,7 @@ from setuptools import setup
 
 
 def readme():
-    with open('README.rst') as f:
+    with open('README.md') as f:
         return f.read()
 
 
@@ -10,6 +10,7 @@ setup(name='training',
       version='0.1',
       description='Parse recipes for measurements and ingredients',
       long_description=readme(),
+      long_description_content_type='text/markdown',
       classifiers=[
           'Programming Language :: Python :: 3.7',
           'Topic :: NLP :: NER :: Text Processing :: Recipes',
@@ -18,11 +19,18 @@ setup(name='training',
       author='Jef Judes',
       author_email='jefrey.judes@gmail.com',
       license='MIT',
-      packages=['training'],
+      packages=['app', 'app.utils', 'src', 'src.utils'],
+      package_dir={'app': 'inference/app', 'src': 'training/src'},
+      package_data={'app.utils': ['densities.csv'], 'src.utils': ['densities.csv']},
+      entry_points={
+          'console_scripts': ['chef=app.cli:main']
+      },
       install_requires=[
           'spacy',
           'python-crfsuite',
-          'recipe-scrapers'
+          'recipe-scrapers',
+          'numpy',
+          'requests'
       ],
       include_package_data=True,
       zip_safe=False)
@@ -0,0 +1,99 @@
+import re
+import csv
+import time
+import argparse
+import src.utils.parser as parser
+from src.utils.constants import VULGAR, SUPERSCRIPT, SUBSCRIPT
+
+
+def legacy_asfloat(s):
+    """
+    Reference implementation of asfloat using uncompiled re.match calls,
+    as parser.py did before the single-pass quantity engine
+    """
+
+    n = 0
+    mixed = (re.match(parser.mixed_ascii_re + '$', s) or
+             re.match(parser.mixed_other_re + '$', s))
+    if mixed:
+        n = int(mixed[1])
+        s = mixed[2]
+
+    if re.match(parser.integer_re + '$', s) or re.match(parser.decimal_re + '$', s):
+        x = float(s)
+    elif re.match(parser.ascii_re + '$', s) or re.match(parser.vulgar_re + '$', s):
+        a = re.match(parser.ascii_re + '$', VULGAR.get(s, s))
+        x = int(a[1]) / int(a[2])
+    elif re.match(parser.unicode_re + '$', s):
+        u = re.match(parser.unicode_re + '$', s)
+        x = (int(''.join([SUPERSCRIPT[c] for c in u[1]])) /
+             int(''.join([SUBSCRIPT[c] for c in u[2]])))
+    else:
+        raise Exception("Could not interpret string as a non-negative float")
+
+    return n + float(x)
+
+
+def legacy_isnumeric(s):
+    return bool(re.match(parser.numeric_re, s))
+
+
+def load_tokens(data_path):
+    """
+    Whitespace tokens from the "input" column of the training CSV, or a small
+    built-in sample if no path is given
+    """
+
+    if data_path is None:
+        sample = ["1 1/2 cups all-purpose flour", "2 large eggs", "½ tsp salt",
+                  "1½ cups whole milk", "¹⁄₃ cup sugar", "3.5 oz dark chocolate",
+                  "4 tablespoons unsalted butter, softened", "1/4 teaspoon nutmeg"]
+        return [t for line in sample * 1000 for t in line.split()]
+
+    with open(data_path) as f:
+        return [t for entry in csv.DictReader(f) for t in entry["input"].split()]
+
+
+def timed(fn, tokens, repeat):
+    """
+    Best wall-clock time in seconds of fn over all tokens
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(tokens)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    """
+    Compare the legacy and precompiled quantity parsers on training-set tokens
+    Run from the training directory: python -m benchmarks.parser_bench [data.csv]
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('data', nargs='?', type=str, action='store', default=None)
+    argparser.add_argument('--repeat', type=int, action='store', default=3)
+    args = argparser.parse_args()
+
+    tokens = load_tokens(args.data)
+    numeric = [t for t in tokens if parser.isnumeric(t) and parser.quantity(t)]
+
+    # Results must be identical before comparing speed
+    assert [legacy_isnumeric(t) for t in tokens] == [parser.isnumeric(t) for t in tokens]
+    assert [legacy_asfloat(t) for t in numeric] == [q[1] for q in parser.quantities(numeric)]
+
+    rows = [
+        ("isnumeric",
+         timed(lambda ts: [legacy_isnumeric(t) for t in ts], tokens, args.repeat),
+         timed(lambda ts: [parser.isnumeric(t) for t in ts], tokens, args.repeat)),
+        ("asfloat",
+         timed(lambda ts: [legacy_asfloat(t) for t in ts], numeric, args.repeat),
+         timed(parser.quantities, numeric, args.repeat))
+    ]
+
+    print(f"{len(tokens)} tokens, {len(numeric)} quantities")
+    for name, legacy, current in rows:
+        print(f"{name:>10}: legacy {legacy:.4f}s  current {current:.4f}s  "
+              f"speedup {legacy / current:.1f}x")
@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import tempfile
+import itertools
+import multiprocessing
+import pycrfsuite as crf
+from collections import Counter
+from src.train import load_shards, create_trainer
+
+# Parameters searched for each crfsuite training algorithm by default
+DEFAULT_GRID = {
+    "lbfgs": {"c1": [0.0, 0.05, 0.1, 0.5], "c2": [1e-3, 1e-2, 0.1], "max_iterations": [100]},
+    "l2sgd": {"c2": [1e-3, 1e-2, 0.1], "max_iterations": [100]},
+    "ap": {"max_iterations": [50, 100]},
+    "pa": {"c": [0.1, 1.0], "max_iterations": [50, 100]},
+    "arow": {"variance": [0.5, 1.0], "gamma": [0.5, 1.0], "max_iterations": [50, 100]}
+}
+
+# Dataset shared with worker processes, set in the parent before forking so
+# every fold reads the same pages of memory instead of a pickled copy
+_features = None
+_labels = None
+
+
+def param_grid(grid=None):
+    """
+    Expand a grid of {algorithm: {parameter: [values]}} into configurations
+
+    Returns:
+        List of (algorithm, params) for every combination of values
+    """
+
+    if grid is None:
+        grid = DEFAULT_GRID
+
+    configs = []
+    for algorithm, space in grid.items():
+        names = sorted(space)
+        for values in itertools.product(*[space[name] for name in names]):
+            configs.append((algorithm, dict(zip(names, values))))
+
+    return configs
+
+
+def sample_params(grid=None, n=10, seed=0):
+    """
+    Randomly pick n distinct configurations from the grid (random search)
+    """
+
+    configs = param_grid(grid)
+    return random.Random(seed).sample(configs, min(n, len(configs)))
+
+
+def entity(label):
+    """
+    Strip the BILUO prefix from a label, e.g. B-Unit -> Unit
+    """
+
+    return label.split("-", 1)[-1]
+
+
+def label_scores(true, pred):
+    """
+    Token-level precision, recall and F1 for each entity label
+
+    Arguments:
+        true: list of gold label sequences
+        pred: list of predicted label sequences
+
+    Returns:
+        Dictionary mapping label to {"precision", "recall", "f1", "support"}
+    """
+
+    tp = Counter()
+    fp = Counter()
+    fn = Counter()
+
+    for yseq, pseq in zip(true, pred):
+        for y, p in zip(yseq, pseq):
+            y = entity(y)
+            p = entity(p)
+            if y == p:
+                tp[y] += 1
+            else:
+                fp[p] += 1
+                fn[y] += 1
+
+    scores = {}
+    for label in set(tp) | set(fn) | set(fp):
+        if label == "O":
+            continue
+        precision = tp[label] / (tp[label] + fp[label]) if tp[label] + fp[label] else 0.0
+        recall = tp[label] / (tp[label] + fn[label]) if tp[label] + fn[label] else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        scores[label] = {"precision": precision,
+                         "recall": recall,
+                         "f1": f1,
+                         "support": tp[label] + fn[label]}
+
+    return scores
+
+
+def _run_fold(args):
+    """
+    Train on every fold but one and score the held out fold (worker task)
+    """
+
+    algorithm, params, fold, k, work_dir = args
+
+    model = create_trainer(params, algorithm, verbose=False)
+    for i, (xseq, yseq) in enumerate(zip(_features, _labels)):
+        if i % k != fold:
+            model.append(xseq, yseq)
+
+    model_path = os.path.join(work_dir, f"{os.getpid()}-{fold}.crfsuite")
+
+    start = time.perf_counter()
+    model.train(model_path)
+    elapsed = time.perf_counter() - start
+
+    tagger = crf.Tagger()
+    tagger.open(model_path)
+    held_out = range(fold, len(_features), k)
+    pred = [tagger.tag(_features[i]) for i in held_out]
+    tagger.close()
+    os.remove(model_path)
+
+    return label_scores([_labels[i] for i in held_out], pred), elapsed
+
+
+def _mean_scores(fold_scores):
+    """
+    Average per-label F1 over folds, counting a missing label as F1 of 0
+    """
+
+    labels = set().union(*fold_scores)
+    return {label: sum(s[label]["f1"] for s in fold_scores if label in s) / len(fold_scores)
+            for label in sorted(labels)}
+
+
+def search(shard_dir,
+           model_path,
+           configs=None,
+           k=5,
+           n_workers=None):
+    """
+    Grid or random search over crfsuite algorithms and parameters with k-fold
+    cross-validation, saving a model trained on all data with the best one
+
+    Features are loaded once from the shards of build_shards and shared by
+    every fold. Each (configuration, fold) pair is trained in a process pool
+
+    Arguments:
+        shard_dir: directory containing shards and manifest from build_shards
+        model_path: path to save the best CRF data to
+        configs: list of (algorithm, params), e.g. from param_grid or sample_params
+        k: number of cross-validation folds
+        n_workers: number of worker processes (all cores if None)
+
+    Returns:
+        Leaderboard: list of dictionaries with algorithm, params, per-label F1,
+        macro F1 and mean training time, best first
+    """
+
+    global _features, _labels
+
+    if configs is None:
+        configs = param_grid()
+
+    _features = []
+    _labels = []
+    for x, y in load_shards(shard_dir):
+        _features.extend(x)
+        _labels.extend(y)
+
+    assert (len(_features) >= k)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tasks = [(algorithm, params, fold, k, work_dir)
+                 for algorithm, params in configs
+                 for fold in range(k)]
+
+        with multiprocessing.get_context("fork").Pool(n_workers) as pool:
+            results = pool.map(_run_fold, tasks)
+
+    leaderboard = []
+    for n, (algorithm, params) in enumerate(configs):
+        folds = results[n * k:(n + 1) * k]
+        f1 = _mean_scores([scores for scores, _ in folds])
+        leaderboard.append({
+            "algorithm": algorithm,
+            "params": params,
+            "f1": f1,
+            "macro_f1": sum(f1.values()) / len(f1) if f1 else 0.0,
+            "train_time": sum(elapsed for _, elapsed in folds) / k
+        })
+
+    leaderboard.sort(key=lambda row: (-row["macro_f1"], row["train_time"]))
+    print_leaderboard(leaderboard)
+
+    best = leaderboard[0]
+    model = create_trainer(best["params"], best["algorithm"], verbose=False)
+    for xseq, yseq in zip(_features, _labels):
+        model.append(xseq, yseq)
+    model.train(model_path)
+
+    _features = _labels = None
+
+    return leaderboard
+
+
+def print_leaderboard(leaderboard):
+    """
+    Print macro F1, per-label F1 and training time for each configuration
+    """
+
+    labels = sorted(set().union(*[row["f1"] for row in leaderboard]))
+
+    header = f"{'algorithm':<10}{'params':<48}{'macro':>8}"
+    header += "".join(f"{label[:11]:>12}" for label in labels) + f"{'time (s)':>10}"
+    print(header)
+
+    for row in leaderboard:
+        params = ", ".join(f"{name}={value}" for name, value in row["params"].items())
+        line = f"{row['algorithm']:<10}{params[:47]:<48}{row['macro_f1']:>8.3f}"
+        line += "".join(f"{row['f1'].get(label, 0.0):>12.3f}" for label in labels)
+        line += f"{row['train_time']:>10.1f}"
+        print(line)
@@ -1,12 +1,44 @@
+import os
 import csv
+import json
+import time
 import pickle
+import hashlib
+import resource
 import spacy
+import multiprocessing
 import pycrfsuite as crf
 import src.utils.parser as parser
+import src.utils.bundle as bundle
+import src.utils.constants as constants
 import src.utils.preprocessor as preprocessor
+from itertools import islice
+from collections import Counter
 
 
-def match_labels(entry, nlp):
+def lemmatize(texts, nlp, memo, batch_size=256):
+    """
+    Add lemmas of each distinct text not yet in memo using one batched pass
+
+    Arguments:
+        texts: iterable of strings (e.g. values of the name or unit column)
+        nlp: instance of spacy nlp data
+        memo: dictionary mapping text to tuple of token lemmas, updated in place
+        batch_size: number of texts spacy processes per batch
+
+    Returns:
+        memo
+    """
+
+    missing = list(dict.fromkeys(text for text in texts if text not in memo))
+
+    for text, doc in zip(missing, nlp.pipe(missing, batch_size=batch_size)):
+        memo[text] = tuple(token.lemma_ for token in doc)
+
+    return memo
+
+
+def match_labels(entry, nlp, memo=None):
     """
     Tokenize recipe line using spacy and label tokens
 
@@ -18,6 +50,10 @@ def match_labels(entry, nlp):
                - "range_end": <the upper limit if range, or 0> (float-like)
                - "comment": <other specifications> (string)
         nlp: instance of spacy nlp data
+        memo: optional dictionary of name and unit lemmas shared between calls;
+              without one the name and unit are lemmatized on every call, so
+              pass the same dictionary when labelling many entries (or use
+              create_sequences, which also batches the lemmatization)
 
     Sample Input:
         entry: {"input": "1/2 cup oranges, freshly squeezed"
@@ -34,13 +70,36 @@ def match_labels(entry, nlp):
 
     # Raw tokens in line
     tokens = nlp(entry["input"])
-    labels = []
 
     # Labelled parts
-    ingr = [token.lemma_ for token in nlp(entry["name"])]
-    unit = [parser.standardize(token.lemma_) for token in nlp(entry["unit"])]
+    if memo is None:
+        memo = {}
+    lemmatize([entry["name"], entry["unit"]], nlp, memo)
     #     comment = [token.lower_ for token in nlp(entry["comment"])]
 
+    return tokens, label_tokens(entry, tokens, memo[entry["name"]], memo[entry["unit"]])
+
+
+def label_tokens(entry, tokens, ingr, unit):
+    """
+    Label already tokenized recipe line (helper for match_labels)
+
+    Arguments:
+        entry: dictionary-like map as described in match_labels
+        tokens: spacy Tokens of entry["input"]
+        ingr: lemmas of the ingredient name
+        unit: lemmas of the unit
+
+    Returns:
+        labels: list of label strings, one per token
+    """
+
+    labels = []
+
+    # Remaining number of matches allowed for each lemma
+    ingr = Counter(ingr)
+    unit = Counter(parser.standardize(lemma) for lemma in unit)
+
     try:
         qty = float(entry["qty"])
     except ValueError:
@@ -78,13 +137,13 @@ def match_labels(entry, nlp):
             labels.append("Upper Range")
 
         # Check for other labels
-        elif parser.standardize(token.lemma_) in unit:
+        elif unit[parser.standardize(token.lemma_)] > 0:
             labels.append("Unit")
-            unit.remove(parser.standardize(token.lemma_))
+            unit[parser.standardize(token.lemma_)] -= 1
 
-        elif token.lemma_ in ingr:
+        elif ingr[token.lemma_] > 0:
             labels.append("Ingredient")
-            ingr.remove(token.lemma_)
+            ingr[token.lemma_] -= 1
 
         #         elif token.lower_ in comment:
         #             labels.append("Comment")
@@ -94,10 +153,10 @@ def match_labels(entry, nlp):
         else:
             labels.append("")
 
-    return tokens, labels
+    return labels
 
 
-def create_sequence(entry, nlp):
+def create_sequence(entry, nlp, memo=None):
     """
     Tokenize and create features to pass crfsuite
     Label each token and tab using BILUO scheme
@@ -105,46 +164,288 @@ def create_sequence(entry, nlp):
     Arguments:
         entry: dictionary-like map to pass into match_labels
         nlp: instance of spacy nlp data
+        memo: optional dictionary of lemmas shared between calls (see match_labels)
 
     Returns:
-        xseq: list of dictionaries containing features
+        xseq: list of dictionaries of crfsuite attributes (see create_attributes)
         yseq: list of corresponding BILUO-tagged labels
     """
 
-    tokens, labels = match_labels(entry, nlp)
+    tokens, labels = match_labels(entry, nlp, memo)
 
     yseq = preprocessor.biluo_tag(labels)
-    xseq = preprocessor.create_features(tokens)
+    xseq = preprocessor.create_attributes(tokens)
 
     return xseq, yseq
 
 
+def create_sequences(entries, nlp, batch_size=256, memo=None):
+    """
+    Batched version of create_sequence using nlp.pipe
+
+    The name and unit columns have a small vocabulary, so their distinct
+    values are lemmatized once into memo instead of once per row
+
+    Arguments:
+        entries: list of dictionary-like maps to pass into match_labels
+        nlp: instance of spacy nlp data
+        batch_size: number of texts spacy processes per batch
+        memo: optional dictionary of name and unit lemmas shared between calls
+
+    Yields:
+        (xseq, yseq) for each entry, in order
+    """
+
+    if memo is None:
+        memo = {}
+
+    lemmatize((entry[column] for entry in entries for column in ("name", "unit")),
+              nlp, memo, batch_size)
+
+    inputs = nlp.pipe((entry["input"] for entry in entries), batch_size=batch_size)
+
+    for entry, tokens in zip(entries, inputs):
+        labels = label_tokens(entry, tokens, memo[entry["name"]], memo[entry["unit"]])
+
+        yield preprocessor.create_attributes(tokens), preprocessor.biluo_tag(labels)
+
+
+# spacy pipeline loaded once per worker process by _init_worker, along with
+# the name and unit lemmas seen by that worker
+_worker_nlp = None
+_worker_memo = {}
+
+
+def _init_worker(spacy_model):
+    global _worker_nlp
+    _worker_nlp = spacy.load(spacy_model)
+    # With one worker this runs in the calling process, where lemmas of an
+    # earlier build with another pipeline may still be memoized
+    _worker_memo.clear()
+
+
+def _build_shard(args):
+    """
+    Create features and labels for one shard of rows in a worker process
+    """
+
+    index, entries, batch_size = args
+    sequences = list(create_sequences(entries, _worker_nlp, batch_size, _worker_memo))
+    return index, [x for x, _ in sequences], [y for _, y in sequences]
+
+
+def _shards(reader, shard_size):
+    """
+    Group rows of the CSV reader into lists of shard_size rows
+    """
+
+    while True:
+        shard = list(islice(reader, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+def _run_shards(data_path, n_workers, shard_size, batch_size, spacy_model, done=()):
+    """
+    Create features and labels for each shard of the CSV not in done,
+    printing progress as shards complete
+
+    Yields:
+        (shard index, features, labels) in the order of the CSV
+    """
+
+    start = time.perf_counter()
+    rows = 0
+
+    with open(data_path) as f:
+        shards = ((index, shard, batch_size)
+                  for index, shard in enumerate(_shards(csv.DictReader(f), shard_size))
+                  if index not in done)
+
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers, _init_worker, (spacy_model,))
+            results = pool.imap(_build_shard, shards)
+        else:
+            pool = None
+            _init_worker(spacy_model)
+            results = map(_build_shard, shards)
+
+        try:
+            for index, x, y in results:
+                rows += len(x)
+                elapsed = time.perf_counter() - start
+                print(f"{rows} rows in {elapsed:.1f}s "
+                      f"({rows / elapsed:.0f} rows/s)")
+
+                yield index, x, y
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+
+def _file_hash(*paths):
+    """
+    Return a hash of the contents of the files at paths
+    """
+
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    """
+    Call write with a file object for a temporary file, then move it to path
+    so that an interrupted run never leaves a partial file behind
+    """
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def build_shards(data_path,
+                 shard_dir,
+                 n_workers=1,
+                 shard_size=1000,
+                 batch_size=256,
+                 spacy_model='en_core_web_sm'):
+    """
+    Build the dataset as pickled shards in shard_dir, recording completed
+    shards in shard_dir/manifest.json as they are written
+
+    Re-running with the same inputs skips shards that are already complete. If
+    the CSV, the feature code, the spacy pipeline or the shard size change,
+    existing shards are stale and the dataset is rebuilt from scratch
+
+    Arguments:
+        data_path: path to CSV dataset
+        shard_dir: directory to write shards and manifest to
+        n_workers: number of worker processes
+        shard_size: number of rows per shard
+        batch_size: number of texts spacy processes per batch
+        spacy_model: name of spacy pipeline to load
+
+    Returns:
+        manifest: dictionary describing the completed dataset
+    """
+
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_path = os.path.join(shard_dir, "manifest.json")
+
+    key = {
+        "source": _file_hash(data_path),
+        "code": _file_hash(constants.__file__, parser.__file__,
+                           preprocessor.__file__, __file__),
+        "spacy_model": spacy_model,
+        "spacy_version": spacy.__version__,
+        "model_version": spacy.util.get_package_version(spacy_model),
+        "shard_size": shard_size
+    }
+
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if manifest is None or manifest["key"] != key:
+        if manifest is not None:
+            print("Existing shards are stale, rebuilding dataset")
+            for shard in manifest["shards"].values():
+                if os.path.exists(os.path.join(shard_dir, shard["file"])):
+                    os.remove(os.path.join(shard_dir, shard["file"]))
+        manifest = {"key": key, "shards": {}, "complete": False}
+
+    if manifest["complete"]:
+        return manifest
+
+    done = {int(index) for index in manifest["shards"]}
+    if done:
+        print(f"Resuming after {len(done)} completed shards")
+
+    for index, x, y in _run_shards(data_path, n_workers, shard_size,
+                                   batch_size, spacy_model, done):
+        name = f"shard-{index:05d}.pkl"
+        _write_atomic(os.path.join(shard_dir, name),
+                      lambda f: pickle.dump((x, y), f))
+
+        manifest["shards"][str(index)] = {"file": name, "rows": len(x)}
+        _write_atomic(manifest_path,
+                      lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+    manifest["complete"] = True
+    _write_atomic(manifest_path,
+                  lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+    return manifest
+
+
+def load_shards(shard_dir):
+    """
+    Load the shards of a dataset built by build_shards one at a time
+
+    Yields:
+        (features, labels) for each shard, in the order of the CSV
+    """
+
+    with open(os.path.join(shard_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    assert (manifest["complete"])
+
+    for index in sorted(manifest["shards"], key=int):
+        with open(os.path.join(shard_dir, manifest["shards"][index]["file"]), "rb") as f:
+            yield pickle.load(f)
+
+
 def build_dataset(data_path,
                   features_path="features.pkl",
                   labels_path="labels.pkl",
-                  save=True):
+                  save=True,
+                  n_workers=1,
+                  shard_size=1000,
+                  batch_size=256,
+                  spacy_model='en_core_web_sm',
+                  shard_dir=None):
     """
     Accepts CSV dataset with columns matching keys for match_labels
     Returns (and saves) sequences of features and labels to pass into crf-suite
 
+    Rows are split into shards of shard_size rows. With n_workers > 1 shards
+    are processed by a pool of worker processes, each with its own spacy
+    pipeline; results are always collected in the order of the CSV
+
     Arguments:
         data_path: path to CSV dataset
         features_path: path to save features to
         labels_path: path to save labels to
         save: flag indicating whether or not to save the resulting dataset
+        n_workers: number of worker processes
+        shard_size: number of rows per shard
+        batch_size: number of texts spacy processes per batch
+        spacy_model: name of spacy pipeline to load
+        shard_dir: optional directory to checkpoint shards to (see build_shards)
     """
 
     features = []
     labels = []
 
-    nlp = spacy.load('en_core_web_sm')
+    if shard_dir is not None:
+        build_shards(data_path, shard_dir, n_workers, shard_size, batch_size, spacy_model)
+        shards = load_shards(shard_dir)
+    else:
+        shards = ((x, y) for _, x, y in _run_shards(data_path, n_workers, shard_size,
+                                                      batch_size, spacy_model))
 
-    with open(data_path) as f:
-        reader = csv.DictReader(f)
-        for entry in reader:
-            x, y = create_sequence(entry, nlp)
-            features.append(x)
-            labels.append(y)
+    for x, y in shards:
+        features.extend(x)
+        labels.extend(y)
 
     if save:
         pickle.dump(features, open(features_path, 'wb'))
@@ -153,11 +454,55 @@ def build_dataset(data_path,
     return features, labels
 
 
+def create_trainer(params=None, algorithm=None, verbose=True):
+    """
+    Create a crfsuite Trainer with optional parameters and algorithm
+    """
+
+    model = crf.Trainer(verbose=verbose)
+    # Algorithm must be selected first, as it determines the valid parameters
+    if algorithm is not None:
+        model.select(algorithm)
+    if params is not None:
+        model.set_params(params)
+    return model
+
+
+def _report(sequences, start):
+    """
+    Print number of sequences loaded, load time and peak memory of the process
+    """
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Loaded {sequences} sequences in {time.perf_counter() - start:.1f}s, "
+          f"peak memory {peak:.0f} MB")
+
+
+def _save(model, model_path, spacy_model, params, algorithm):
+    """
+    Train model and save it to model_path, as a model bundle if spacy_model is given
+    """
+
+    if spacy_model is None:
+        model.train(model_path)
+        return
+
+    crf_path = model_path + ".crf.tmp"
+    model.train(crf_path)
+    try:
+        bundle.write_bundle(model_path, crf_path, spacy_model,
+                            {"algorithm": algorithm, "params": params})
+    finally:
+        os.remove(crf_path)
+
+
 def train_crf(features_path,
               labels_path,
               model_path,
               params=None,
-              algorithm=None):
+              algorithm=None,
+              spacy_model=None):
     """
     Train a CRF using python-crfsuite and return resulting data
 
@@ -167,13 +512,12 @@ def train_crf(features_path,
         model_path: path to save resulting CRF data to
         params: optional dictionary containing parameters for CRF data
         algorithm: optional specification for optimization algorithm used to train
+        spacy_model: name or path of the spacy pipeline the features were created
+                     with; if given, model_path is written as a model bundle
     """
 
-    model = crf.Trainer()
-    if params is not None:
-        model.set_params(params)
-    if algorithm is not None:
-        model.select(algorithm)
+    model = create_trainer(params, algorithm)
+    start = time.perf_counter()
 
     with open(features_path, "rb") as f:
         features = pickle.load(f)
@@ -184,6 +528,44 @@ def train_crf(features_path,
     for xseq, yseq in zip(features, labels):
         model.append(xseq, yseq)
 
-    model.train(model_path)
+    _report(len(features), start)
+
+    _save(model, model_path, spacy_model, params, algorithm)
+
+    return model
+
+
+def train_crf_from_shards(shard_dir,
+                          model_path,
+                          params=None,
+                          algorithm=None,
+                          spacy_model=None):
+    """
+    Train a CRF streaming sequences from the shards written by build_shards,
+    so that only one shard of Python feature dictionaries is held in memory
+    at a time (crfsuite keeps its own compact copy of the data)
+
+    Arguments:
+        shard_dir: directory containing shards and manifest from build_shards
+        model_path: path to save resulting CRF data to
+        params: optional dictionary containing parameters for CRF data
+        algorithm: optional specification for optimization algorithm used to train
+        spacy_model: name or path of the spacy pipeline the features were created
+                     with; if given, model_path is written as a model bundle
+    """
+
+    model = create_trainer(params, algorithm)
+    start = time.perf_counter()
+    sequences = 0
+
+    for features, labels in load_shards(shard_dir):
+        for xseq, yseq in zip(features, labels):
+            model.append(xseq, yseq)
+        sequences += len(features)
+        del features, labels
+
+    _report(sequences, start)
+
+    _save(model, model_path, spacy_model, params, algorithm)
 
     return model
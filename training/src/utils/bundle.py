@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import struct
+import hashlib
+import warnings
+import src.utils.preprocessor as preprocessor
+
+# A model bundle is a single file made of:
+#   MAGIC, the length of the header as a 4 byte big-endian integer, a JSON
+#   header, then the CRF model exactly as written by crfsuite
+# The header records the feature configuration and spacy pipeline the model
+# was trained with and a hash identifying the bundle's contents, so a bundle
+# can be checked and identified by reading only its first few hundred bytes
+MAGIC = b"CHEFCRF\n"
+FORMAT_VERSION = 1
+
+_LENGTH = struct.Struct(">I")
+
+# Keys every bundle header has
+_REQUIRED = ("format", "features", "spacy", "hash", "crf_size")
+
+
+class BundleError(Exception):
+    """
+    Raised when a model bundle is corrupt or does not match this code
+    """
+
+
+def feature_config():
+    """
+    Feature configuration of the current preprocessor
+    """
+
+    return {"version": preprocessor.FEATURE_VERSION, "names": list(preprocessor.FEATURES)}
+
+
+def pipeline_info(spacy_model):
+    """
+    Identity of a spacy pipeline given by name or path, read from its meta
+    data without loading the pipeline
+
+    Returns:
+        Dictionary of model (<lang>_<name>), version and spacy_version
+    """
+
+    import spacy
+
+    if spacy.util.is_package(spacy_model):
+        meta = spacy.util.get_model_meta(spacy.util.get_package_path(spacy_model))
+    else:
+        meta = spacy.util.get_model_meta(spacy_model)
+
+    return {"model": f"{meta['lang']}_{meta['name']}",
+            "version": meta["version"],
+            "spacy_version": spacy.__version__}
+
+
+def nlp_info(nlp):
+    """
+    Identity of a loaded spacy pipeline (see pipeline_info)
+    """
+
+    import spacy
+
+    return {"model": f"{nlp.meta['lang']}_{nlp.meta['name']}",
+            "version": nlp.meta["version"],
+            "spacy_version": spacy.__version__}
+
+
+def _content_hash(config, data):
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def write_bundle(bundle_path, crf_path, spacy_model, metadata=None):
+    """
+    Package a CRF model trained by crfsuite into a model bundle
+
+    Arguments:
+        bundle_path: path to write the bundle to
+        crf_path: path of the CRF model written by crfsuite
+        spacy_model: name or path of the spacy pipeline the features were created with
+        metadata: optional JSON-serializable dictionary stored in the header
+
+    Returns:
+        header: dictionary written to the bundle header
+    """
+
+    with open(crf_path, "rb") as f:
+        data = f.read()
+
+    config = {"features": feature_config(), "spacy": pipeline_info(spacy_model)}
+
+    header = dict(config,
+                  format=FORMAT_VERSION,
+                  hash=_content_hash(config, data),
+                  crf_size=len(data),
+                  created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  metadata=metadata or {})
+
+    encoded = json.dumps(header, indent=2).encode()
+
+    tmp = bundle_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_LENGTH.pack(len(encoded)))
+        f.write(encoded)
+        f.write(data)
+    os.replace(tmp, bundle_path)
+
+    return header
+
+
+def read_header(path):
+    """
+    Read and check the header of a model bundle without reading the model
+
+    Returns:
+        header dictionary, or None if path is a bare crfsuite model
+
+    Raises:
+        BundleError: if the header is unreadable or incomplete, the bundle is
+                     truncated or was made for a different format or
+                     feature configuration
+    """
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+
+        try:
+            length, = _LENGTH.unpack(f.read(_LENGTH.size))
+            header = json.loads(f.read(length))
+        except (struct.error, ValueError) as e:
+            raise BundleError(f"Corrupt header in model bundle {path}: {e}")
+
+        if not isinstance(header, dict):
+            raise BundleError(f"Corrupt header in model bundle {path}: not a JSON object")
+        missing = [key for key in _REQUIRED if key not in header]
+        if missing:
+            raise BundleError(f"Corrupt header in model bundle {path}: missing {', '.join(missing)}")
+        if not isinstance(header["crf_size"], int):
+            raise BundleError(f"Corrupt header in model bundle {path}: crf_size is not an integer")
+
+        offset = len(MAGIC) + _LENGTH.size + length
+        if os.fstat(f.fileno()).st_size != offset + header["crf_size"]:
+            raise BundleError(f"Model bundle {path} is truncated")
+
+    if header["format"] != FORMAT_VERSION:
+        raise BundleError(f"Model bundle {path} has format {header['format']}, "
+                          f"expected {FORMAT_VERSION}")
+    if header["features"] != feature_config():
+        raise BundleError(f"Model bundle {path} was trained with features "
+                          f"{header['features']}, this version creates {feature_config()}")
+
+    header["offset"] = offset
+    return header
+
+
+def read_model(path, header, verify=False):
+    """
+    Read the CRF model of a bundle whose header was read by read_header
+
+    Arguments:
+        path: path of the bundle
+        header: header of the bundle
+        verify: flag indicating whether to check the content hash
+
+    Returns:
+        bytes of the CRF model, e.g. for crfsuite's Tagger.open_inmemory
+    """
+
+    with open(path, "rb") as f:
+        f.seek(header["offset"])
+        data = f.read(header["crf_size"])
+
+    if verify:
+        config = {"features": header["features"], "spacy": header["spacy"]}
+        if _content_hash(config, data) != header["hash"]:
+            raise BundleError(f"Content hash mismatch in model bundle {path}")
+
+    return data
+
+
+def check_pipeline(header, info):
+    """
+    Check that a spacy pipeline (see nlp_info) is the one a bundle expects
+
+    A different pipeline raises BundleError, since its tags, parses and
+    entities are not the features the model was trained on. A different
+    version of the same pipeline or of spacy only warns
+    """
+
+    expected = header["spacy"]
+
+    if info["model"] != expected["model"]:
+        raise BundleError(f"Model was trained with spacy pipeline {expected['model']}, "
+                          f"but {info['model']} is loaded")
+
+    if (info["version"], info["spacy_version"]) != (expected["version"], expected["spacy_version"]):
+        warnings.warn(f"Model was trained with {expected['model']} {expected['version']} "
+                      f"on spacy {expected['spacy_version']}, but {info['version']} "
+                      f"on spacy {info['spacy_version']} is loaded")
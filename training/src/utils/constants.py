@@ -80,31 +80,4 @@ UNITS = {
     "length": LENGTH
 }
 
-# grams / ml
-DENSITY = {
-    'water': 1,
-    
-    'flour': 140/240,
-    'all purpose flour': 140/240,
-    'all-purpose flour': 140/240,
-    'cake flour': 140/240,
-    'self-raising flour': 140/240,
-    
-    'cornflour': 122/240,
-    'cornstarch': 122/240,
-    'corn starch': 122/240,
-    
-    'sugar': 202/240,
-    'granulated sugar': 202/240,
-    'white sugar': 202/240,
-    'brown sugar': 202/240,
-    'caster sugar': 228/240,
-    'icing sugar': 126/240,
-    'powdered sugar': 126/240,
-    'confectioners sugar': 126/240,
-    
-    'honey': 345/240,
-    'butter': 454/480,
-    'oil': 214/240,
-    'cocoa powder': 111/240
-}
\ No newline at end of file
+# Densities of ingredients (grams / ml) are in densities.csv, see density.py
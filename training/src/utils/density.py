@@ -0,0 +1,113 @@
+import os
+import re
+import csv
+from functools import lru_cache
+
+# Densities of ingredients as grams per millilitres, one ingredient per row
+DENSITY_PATH = os.path.join(os.path.dirname(__file__), "densities.csv")
+
+_word = re.compile(r"[a-z0-9]+")
+
+# Marks the end of an ingredient name in a trie node
+_END = None
+
+
+def normalize(name):
+    """
+    Split an ingredient name into normalized tokens: lowercase words with
+    punctuation removed and a plural s dropped, so that "All-Purpose Flour"
+    and "all purpose flours" give the same tokens
+    """
+
+    tokens = _word.findall(name.lower())
+    return tuple(t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t
+                 for t in tokens)
+
+
+def load_densities(path=DENSITY_PATH):
+    """
+    Read a density table with columns ingredient, grams and millilitres
+
+    Returns:
+        Dictionary mapping each ingredient name to its density in g/ml
+    """
+
+    with open(path, newline="") as f:
+        return {row["ingredient"]: float(row["grams"]) / float(row["millilitres"])
+                for row in csv.DictReader(f)}
+
+
+class DensityIndex:
+    """
+    Token trie over the names of a density table for longest-match lookup
+
+    An ingredient's density is the one of the longest table name that ends
+    at its head noun, the last token before the first comma. For example
+    "unsalted butter, softened" matches "unsalted butter" and "brown rice
+    flour" matches "rice flour", while "water chestnuts" and "sugar snap
+    peas" match nothing rather than "water" and "sugar"
+    """
+
+    def __init__(self, densities):
+        """
+        Arguments:
+            densities: dictionary mapping ingredient name to density in g/ml
+        """
+
+        self.densities = densities
+        self._trie = {}
+
+        for name, density in densities.items():
+            node = self._trie
+            for token in normalize(name):
+                node = node.setdefault(token, {})
+            node[_END] = density
+
+    def __len__(self):
+        return len(self.densities)
+
+    def lookup(self, name):
+        """
+        Density of ingredient name in g/ml, or None if no table name matches
+        """
+
+        tokens = normalize(name.split(",", 1)[0])
+
+        # The first start whose run reaches the head is the longest match
+        for start in range(len(tokens)):
+            node = self._trie
+            for token in tokens[start:]:
+                node = node.get(token)
+                if node is None:
+                    break
+            else:
+                if _END in node:
+                    return node[_END]
+
+        return None
+
+
+_index = None
+
+
+def default_index():
+    """
+    DensityIndex of the bundled density table, loaded on first use
+    """
+
+    global _index
+    if _index is None:
+        _index = DensityIndex(load_densities())
+    return _index
+
+
+@lru_cache(maxsize=65536)
+def density(name):
+    """
+    Density of ingredient name in g/ml from the bundled table, or None if
+    unknown. Results are memoized per name
+    """
+
+    if not name:
+        return None
+    return default_index().lookup(name)
@@ -1,5 +1,22 @@
+import sys
 import src.utils.parser as parser
 
+# Features created for each token, recorded in model bundles. Bump the
+# version whenever a feature changes meaning so old models are rejected
+FEATURES = ("token", "length", "is_numeric", "is_punctuation", "is_title",
+            "is_parenthetical", "entity", "pos", "tag", "dependency")
+FEATURE_VERSION = 1
+
+# Lexical attributes of each distinct token text, shared by every sequence
+_lexical = {}
+_LEXICAL_MAX = 100000
+
+# Interned "name:value" crfsuite attribute names of string features
+_names = {}
+
+# Entity, part of speech, tag and dependency attributes keyed by their ids
+_syntax = {}
+
 
 def create_features(tokens):
     """
@@ -40,6 +57,98 @@ def create_features(tokens):
     return seq
 
 
+def _attribute(name, value):
+    """
+    Interned crfsuite attribute name for a string feature, e.g. pos:NOUN
+    """
+
+    key = (name, value)
+    attribute = _names.get(key)
+    if attribute is None:
+        attribute = _names[key] = sys.intern(name + ":" + value)
+    return attribute
+
+
+def _lexical_attributes(token):
+    """
+    Attributes that only depend on the token text (helper for create_attributes)
+    """
+
+    if len(_lexical) >= _LEXICAL_MAX:
+        _lexical.clear()
+
+    attributes = _lexical[token.text] = {
+        _attribute("token", token.lower_): 1.0,
+        "length": float(len(token)),
+        "is_numeric": 1.0 if parser.isnumeric(token.text) else 0.0,
+        "is_punctuation": 1.0 if token.is_punct else 0.0,
+        "is_title": 1.0 if token.is_title else 0.0
+    }
+    return attributes
+
+
+def create_attributes(tokens):
+    """
+    Create the same features as create_features, already in the form crfsuite
+    uses internally: a dictionary of attribute name to weight for each token
+
+    String features become "name:value" attributes of weight 1 and other
+    features are weighted by their value, exactly as pycrfsuite converts the
+    dictionaries of create_features. Attributes that depend only on the
+    token text are computed once per distinct text, the remaining string
+    attributes once per distinct combination, and attribute names are interned
+
+    Arguments:
+        tokens: List of spacy Tokens
+
+    Return:
+        seq: List of dictionaries mapping attribute name to weight
+    """
+
+    seq = []
+    is_parenthetical = False
+
+    for token in tokens:
+        text = token.text
+        lexical = _lexical.get(text)
+        if lexical is None:
+            lexical = _lexical_attributes(token)
+
+        key = (token.ent_type, token.pos, token.tag, token.dep)
+        syntax = _syntax.get(key)
+        if syntax is None:
+            syntax = _syntax[key] = {
+                _attribute("entity", token.ent_type_): 1.0,
+                _attribute("pos", token.pos_): 1.0,
+                _attribute("tag", token.tag_): 1.0,
+                _attribute("dependency", token.dep_): 1.0
+            }
+
+        attributes = lexical.copy()
+        attributes["is_parenthetical"] = 1.0 if is_parenthetical else 0.0
+        attributes.update(syntax)
+
+        seq.append(attributes)
+
+        if text == "(":
+            is_parenthetical = True
+        if text == ")":
+            is_parenthetical = False
+
+    return seq
+
+
+def create_items(tokens):
+    """
+    Create a crfsuite ItemSequence for a list of spacy Tokens, ready to be
+    passed to Tagger.tag or Trainer.append (see create_attributes)
+    """
+
+    import pycrfsuite as crf
+
+    return crf.ItemSequence(create_attributes(tokens))
+
+
 def biluo_tag(y):
     """
     Append BILUO tags to the beginning of each label
@@ -0,0 +1,112 @@
+import json
+import struct
+
+import pytest
+import spacy
+
+import src.utils.bundle as bundle
+
+
+CRF = b"crfsuite model bytes" * 10
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    path = str(tmp_path / "pipeline")
+    spacy.blank("en").to_disk(path)
+    return path
+
+
+@pytest.fixture
+def bundle_path(tmp_path, pipeline):
+    crf_path = tmp_path / "model.crfsuite"
+    crf_path.write_bytes(CRF)
+    path = str(tmp_path / "model.bundle")
+    bundle.write_bundle(path, str(crf_path), pipeline, {"algorithm": "lbfgs"})
+    return path
+
+
+def write_raw(path, header, data=CRF):
+    encoded = json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(bundle.MAGIC + struct.pack(">I", len(encoded)) + encoded + data)
+
+
+def test_round_trip(bundle_path, pipeline):
+    header = bundle.read_header(bundle_path)
+
+    assert header["features"] == bundle.feature_config()
+    assert header["spacy"] == bundle.pipeline_info(pipeline)
+    assert header["crf_size"] == len(CRF)
+    assert header["metadata"] == {"algorithm": "lbfgs"}
+    assert bundle.read_model(bundle_path, header, verify=True) == CRF
+
+
+def test_bare_model_has_no_header(tmp_path):
+    path = tmp_path / "model.crfsuite"
+    path.write_bytes(CRF)
+
+    assert bundle.read_header(str(path)) is None
+
+
+def test_truncated_bundle(bundle_path):
+    with open(bundle_path, "rb") as f:
+        data = f.read()
+    with open(bundle_path, "wb") as f:
+        f.write(data[:-10])
+
+    with pytest.raises(bundle.BundleError, match="truncated"):
+        bundle.read_header(bundle_path)
+
+
+@pytest.mark.parametrize("header", [
+    b"{not json",
+    [1, 2, 3],
+    {"format": 1, "features": {}, "spacy": {}, "hash": ""},
+    {"format": 1, "features": {}, "spacy": {}, "hash": "", "crf_size": "200"},
+])
+def test_corrupt_header(tmp_path, header):
+    path = str(tmp_path / "model.bundle")
+    if isinstance(header, bytes):
+        with open(path, "wb") as f:
+            f.write(bundle.MAGIC + struct.pack(">I", len(header)) + header + CRF)
+    else:
+        write_raw(path, header)
+
+    with pytest.raises(bundle.BundleError, match="Corrupt header"):
+        bundle.read_header(path)
+
+
+def test_feature_config_mismatch(bundle_path, tmp_path):
+    header = bundle.read_header(bundle_path)
+    del header["offset"]
+    header["features"] = dict(header["features"], version=header["features"]["version"] + 1)
+    path = str(tmp_path / "other.bundle")
+    write_raw(path, header)
+
+    with pytest.raises(bundle.BundleError, match="trained with features"):
+        bundle.read_header(path)
+
+
+def test_content_hash_mismatch(bundle_path):
+    header = bundle.read_header(bundle_path)
+    with open(bundle_path, "r+b") as f:
+        f.seek(header["offset"])
+        f.write(b"X")
+
+    assert bundle.read_model(bundle_path, header) != CRF
+    with pytest.raises(bundle.BundleError, match="hash mismatch"):
+        bundle.read_model(bundle_path, header, verify=True)
+
+
+def test_check_pipeline(bundle_path):
+    header = bundle.read_header(bundle_path)
+    info = dict(header["spacy"])
+
+    bundle.check_pipeline(header, info)
+
+    with pytest.warns(UserWarning, match="Model was trained with"):
+        bundle.check_pipeline(header, dict(info, version="9.9.9"))
+
+    with pytest.raises(bundle.BundleError, match="spacy pipeline"):
+        bundle.check_pipeline(header, dict(info, model="de_other"))
@@ -0,0 +1,43 @@
+import pytest
+
+from src.utils.density import DensityIndex, density, load_densities
+
+
+@pytest.fixture
+def index():
+    return DensityIndex({"water": 1.0, "sugar": 0.84, "butter": 0.95, "unsalted butter": 0.96,
+                         "flour": 0.58, "rice flour": 0.66})
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("water", 1.0),
+    ("Flour", 0.58),
+    ("all flours", 0.58),
+    ("unsalted butter, softened", 0.96),
+    ("salted butter", 0.95),
+    ("brown rice flour", 0.66),
+    ("sugar, divided", 0.84),
+])
+def test_lookup_matches_at_head(index, name, expected):
+    assert index.lookup(name) == expected
+
+
+@pytest.mark.parametrize("name", [
+    "water chestnuts",
+    "sugar snap peas",
+    "butter beans",
+    "flour tortillas, warmed",
+    "",
+])
+def test_lookup_ignores_matches_before_head(index, name):
+    assert index.lookup(name) is None
+
+
+def test_density_uses_bundled_table():
+    densities = load_densities()
+
+    assert density("water") == densities["water"] == 1.0
+    assert density("Unsalted Butter, softened") == densities["unsalted butter"]
+    assert density("water chestnuts") is None
+    assert density("sugar snap peas") is None
+    assert density(None) is None
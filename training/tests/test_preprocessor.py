@@ -0,0 +1,44 @@
+import pytest
+import spacy
+import pycrfsuite as crf
+from spacy.tokens import Span
+
+import src.utils.preprocessor as preprocessor
+
+
+LINES = [
+    "1 (14.5-ounce) can Diced Tomatoes, drained",
+    "2 Tbsp. Olive Oil (extra virgin)",
+    "Salt and Pepper, to taste",
+    "1/2 cup all-purpose flour (about 2 1/4 ounces)",
+]
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    return spacy.blank("en")
+
+
+def annotate(doc):
+    """
+    Give tokens tags, parses and an entity as a full pipeline would
+    """
+
+    for token in doc:
+        token.pos_ = "NUM" if token.like_num else "NOUN"
+        token.tag_ = "CD" if token.like_num else "NN"
+        token.dep_ = "nummod" if token.like_num else "dobj"
+    doc.ents = [Span(doc, 0, 1, label="CARDINAL")]
+    return doc
+
+
+@pytest.mark.parametrize("line", LINES)
+@pytest.mark.parametrize("annotated", [False, True])
+def test_items_match_features(nlp, line, annotated):
+    doc = annotate(nlp(line)) if annotated else nlp(line)
+
+    expected = crf.ItemSequence(preprocessor.create_features(doc)).items()
+
+    # Twice, so that the second call is served from the attribute caches
+    assert preprocessor.create_items(doc).items() == expected
+    assert preprocessor.create_items(doc).items() == expected
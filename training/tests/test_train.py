@@ -0,0 +1,25 @@
+import src.train as train
+
+
+def test_init_worker_forgets_lemmas_of_earlier_pipelines():
+    train._worker_memo["cups"] = "cup"
+
+    train._init_worker("blank:en")
+
+    assert train._worker_memo == {}
+    assert train._worker_nlp.lang == "en"
+
+
+def test_create_sequence_shares_memo():
+    import spacy
+
+    nlp = spacy.blank("en")
+    entries = [{"input": f"{n} cup flour", "name": "flour", "unit": "cup", "qty": str(n),
+                "range_end": "0", "comment": ""} for n in (1, 2)]
+    memo = {}
+
+    sequences = [train.create_sequence(entry, nlp, memo) for entry in entries]
+
+    assert set(memo) == {"flour", "cup"}
+    assert sequences == list(train.create_sequences(entries, nlp))
+    assert sequences[0][1] == ["U-Quantity", "U-Unit", "U-Ingredient"]